@@ -15,6 +15,14 @@ on mathics-core at a given git reference.
    python ./mathics_benchmark/bench.py -p bench-1565
  - Override the number of iterations:
    python ./mathics_benchmark/bench.py -i 10 bench-1565
+ - Only run the categories or expressions with "Power" in their name:
+   python ./mathics_benchmark/bench.py -k Power calculator-fns
+ - Only run the categories tagged "fast":
+   python ./mathics_benchmark/bench.py -t fast calculator-fns
+ - Record garbage collection pauses:
+   python ./mathics_benchmark/bench.py --gc bench-1565
+ - Record garbage collection pauses, then again with two other thresholds:
+   python ./mathics_benchmark/bench.py --gc-threshold 5000,10,10 --gc-threshold 50000,20,20 bench-1565
 
 If you installed mathics-benchmark, this file can be called as a binary, e.g.:
 - mathics-bench ContinuedFraction
@@ -25,8 +33,9 @@ from typing import Optional, Tuple
 from pathlib import Path
 
 import click
-import code
+import gc
 import importlib
+import inspect
 import json
 import mathics.session
 import os
@@ -35,10 +44,24 @@ import platform
 import psutil
 import subprocess
 import sys
+import time
 import timeit
-import yaml
+import tracemalloc
 
-from mathics.core.parser import parse, MathicsSingleLineFeeder
+from mathics.core.expression import Expression
+from mathics.core.parser import (
+    parse,
+    MathicsMultiLineFeeder,
+    MathicsSingleLineFeeder,
+)
+from mathics.core.symbols import Symbol
+from mathics_benchmark.generators import generate_inputs
+from mathics_benchmark.suite import load_suite, select
+
+try:
+    from mathics_scanner.tokeniser import Tokeniser
+except ImportError:
+    from mathics.core.parser.tokeniser import Tokeniser
 
 
 def source_dir():
@@ -54,14 +77,18 @@ def dump_info(
     timings: dict,
     verbose: int,
     output_path: Optional[str],
+    extra: Optional[dict] = None,
 ) -> None:
     """Write gathered data if `output_path` given. Otherwise if verbose > 0,
     just print out the gathered data.
 
     `timings`: a dictionary of timing information
     `git_repo`: the git repository for Mathics core.
+    `extra`: more sections to write, like "gc" for garbage collection data.
     """
     dump_info = {"timings": timings, "info": get_info(git_repo, cython)}
+    if extra:
+        dump_info.update(extra)
     if verbose:
         if output_path:
             print(f"Dumping information to file {output_path}")
@@ -84,46 +111,70 @@ def get_srcdir() -> str:
 
 
 def get_bench_data(config: str) -> dict:
-    for path in [
-        config,
-        osp.join(my_dir, "benchmarks", config),
-        osp.join(my_dir, "../", "benchmarks", config),
-        osp.join(my_dir, "benchmarks", config + ".yaml"),
-        osp.join(my_dir, "../", "benchmarks", config + ".yaml"),
-    ]:
-        if osp.isfile(path):
-            break
-
-    bench_data = yaml.load(open(path, "r"), Loader=yaml.FullLoader)
+    """The compiled suite for `config`; see mathics_benchmark/suite.py."""
+    return load_suite(config)
 
-    if "includes" in bench_data:
-        include_file: str
 
-        if "categories" not in bench_data:
-            # This allows files without categories, only includes.
-            bench_data["categories"] = {}
+def merge_categories(previous: dict, new: dict) -> dict:
+    """Update `previous`, a dictionary from category to a dictionary by
+    expression like the timings, with `new`.
+    """
+    for category, values in new.items():
+        previous.setdefault(category, {}).update(values)
+    return previous
 
-        for include_file in bench_data["includes"]:
-            # The line bellow is recursive.
-            include_file_bench_data = get_bench_data(include_file)
 
-            # If that file has a default iteration number we add that number to every category which don't have an iteration number.
-            # If we don't do that, the main file iteration number will override the included file iteration number.
-            if "interations" in include_file_bench_data:
-                for category in include_file_bench_data["categories"]:
-                    if "iterations" not in category:
-                        category["iterations"] = include_file_bench_data["iterations"]
+def merge_previous(
+    output_path: str, timings: dict, extra: dict, git_sha: str, cython: bool
+) -> dict:
+    """Add the timings, throughput and garbage collection data of the results
+    in `output_path` that are not in `timings` and `extra`, so that running a
+    part of a suite keeps the results of the rest of it. Return the merged
+    timings.
 
-            bench_data["categories"].update(include_file_bench_data["categories"])
+    Results are only merged with those of the same `git_sha` and `cython`;
+    otherwise they would be credited to a build that didn't make them.
+    """
+    if not osp.isfile(output_path):
+        return timings
+    with open(output_path) as file:
+        previous: dict = json.load(file)
+
+    previous_info: dict = previous.get("info", {})
+    has_cython: str = "Yes" if cython else "No"
+    if (
+        previous_info.get("Git SHA") != git_sha
+        or previous_info.get("Has Cython") != has_cython
+    ):
+        print(
+            f"Warning: {output_path} was made at {previous_info.get('Git SHA')} "
+            f"with Cython {previous_info.get('Has Cython')}, not at {git_sha} "
+            f"with Cython {has_cython}; it is replaced by the new timings only."
+        )
+        return timings
 
-    return bench_data
+    if "throughput" in previous:
+        extra["throughput"] = merge_categories(
+            previous["throughput"], extra.get("throughput", {})
+        )
+    if "gc" in previous:
+        runs: dict = extra.get("gc", {})
+        for threshold, run in runs.items():
+            if threshold in previous["gc"]:
+                for key in ("timings", "stats"):
+                    run[key] = merge_categories(
+                        previous["gc"][threshold][key], run[key]
+                    )
+        # The thresholds which were not run this time are kept.
+        extra["gc"] = {**previous["gc"], **runs}
+    return merge_categories(previous.get("timings", {}), timings)
 
 
 def get_info(repo, cython: bool) -> dict:
 
     locals = {"__version__": "??"}
     exec(
-        open(osp.join(my_dir, "../", "mathics-core", "mathics", "version.py")).read(),
+        open(osp.join(repo.working_dir, "mathics", "version.py")).read(),
         {},
         locals,
     )
@@ -144,6 +195,26 @@ def get_info(repo, cython: bool) -> dict:
     return info
 
 
+def parse_gc_thresholds(ctx, param, values: tuple) -> tuple:
+    """Parse the --gc-threshold options, like "5000,10,10", into tuples of
+    three thresholds. Missing thresholds are the current ones, as with
+    `gc.set_threshold`.
+    """
+    thresholds = []
+    for value in values:
+        try:
+            threshold = tuple(int(number) for number in value.split(","))
+        except ValueError:
+            threshold = ()
+        if not 1 <= len(threshold) <= 3 or min(threshold) < 0:
+            raise click.BadParameter(
+                f"{value!r} should be 1 to 3 non-negative integers separated "
+                "by commas, like 5000,10,10"
+            )
+        thresholds.append(threshold + gc.get_threshold()[len(threshold) :])
+    return tuple(thresholds)
+
+
 @click.command()
 @click.option(
     "-v",
@@ -168,6 +239,42 @@ def get_info(repo, cython: bool) -> dict:
     "--iterations",
     help="Override the number of iterations",
 )
+@click.option(
+    "--gc",
+    "gc_mode",
+    help="Record the garbage collections in every timed expression. "
+    "The garbage collector is then left enabled while timing.",
+    is_flag=True,
+)
+@click.option(
+    "--gc-threshold",
+    "gc_thresholds",
+    multiple=True,
+    callback=parse_gc_thresholds,
+    help="Run again with these garbage collection thresholds, like 5000,10,10, "
+    "to compare. Can be supplied multiple times; implies --gc.",
+)
+@click.option(
+    "-k",
+    "--keyword",
+    "keywords",
+    multiple=True,
+    help="Only run the categories, or the expressions, whose name contains this "
+    "or matches it as a glob pattern. Can be supplied multiple times.",
+)
+@click.option(
+    "-t",
+    "--tag",
+    "tags",
+    multiple=True,
+    help="Only run the categories with this tag. Can be supplied multiple times.",
+)
+@click.option(
+    "--installed",
+    is_flag=True,
+    hidden=True,
+    help="REF is checked out and installed; only run the benchmarks.",
+)
 @click.argument("config", nargs=1, type=click.Path(readable=True), required=True)
 @click.argument("ref", nargs=1, type=click.Path(readable=True), default="master")
 def main(
@@ -177,6 +284,11 @@ def main(
     config: str,
     ref: str,
     iterations: Optional[int],
+    gc_mode: bool,
+    gc_thresholds: tuple,
+    keywords: tuple,
+    tags: tuple,
+    installed: bool,
 ):
     """Runs benchmarks specified in CONFIG on Mathics core at git reference REF.
 
@@ -194,17 +306,23 @@ def main(
     or "d929af3b3ad1a5926942891ad98b17705d423bf2".
 
     REF defaults to "master".
+
+    REF is checked out and installed, then the benchmarks run in a new
+    Python process, so that they time the mathics-core just installed.
+
+    With -k or -t only a part of the suite runs, and its timings replace
+    the ones in the existing results.
     """
 
-    bench_data: dict = get_bench_data(config)
+    bench_data: dict = select(get_bench_data(config), keywords, tags)
+    if not bench_data["categories"]:
+        print("Nothing to run: no category or expression was selected")
+        return 1
     repo = setup_git()
     results_dir: str = osp.join(my_dir, "..", "results")
     short_name: str = osp.basename(config)
     if short_name.endswith(".yaml"):
-        short_name = short_name[: len(".yaml")]
-
-    if pull:
-        repo.remotes.origin.pull()
+        short_name = short_name[: -len(".yaml")]
 
     if cython is None:
         if "cython" in bench_data:
@@ -212,45 +330,106 @@ def main(
         else:
             cython = False
 
-    repo.git.checkout(ref)
+    if not installed:
+        if pull:
+            repo.remotes.origin.pull()
 
-    if verbose:
-        print(f"Mathics git repo {repo.working_dir} at {repo.head.commit.hexsha[:6]}")
+        repo.git.checkout(ref)
 
-    rc = setup_environment(verbose, cython)
-    if rc != 0:
+        if verbose:
+            print(
+                f"Mathics git repo {repo.working_dir} at {repo.head.commit.hexsha[:6]}"
+            )
+
+        rc = setup_environment(verbose, cython)
+        if rc == 0:
+            # This process imported mathics before REF was installed, so the
+            # benchmarks run in a new one, which imports the installed REF.
+            command = [sys.executable, "-m", "mathics_benchmark.bench", "--installed"]
+            command.append("--cython" if cython else "--no-cython")
+            if verbose:
+                command.append("-" + "v" * verbose)
+            if iterations:
+                command += ["-i", str(iterations)]
+            if gc_mode:
+                command.append("--gc")
+            for threshold in gc_thresholds:
+                command += ["--gc-threshold", ",".join(map(str, threshold))]
+            for keyword in keywords:
+                command += ["-k", keyword]
+            for tag in tags:
+                command += ["-t", tag]
+            command += [osp.abspath(config) if osp.isfile(config) else config, ref]
+            rc = subprocess.run(command, cwd=osp.join(my_dir, "..")).returncode
+
+        repo.git.checkout("master")
         return rc
 
+    check_installed(repo)
+
     if ref != "master":
         try:
             os.mkdir(osp.join(results_dir, ref))
         except Exception:
             pass
 
-    timings = run_benchmark(bench_data, verbose, iterations)
+    extra: dict = {}
+    parse_stats: dict = {}
+    if gc_mode or gc_thresholds:
+        timings, extra["gc"] = run_gc_benchmarks(
+            bench_data, verbose, iterations, gc_thresholds, parse_stats
+        )
+    else:
+        timings = run_benchmark(bench_data, verbose, iterations, None, parse_stats)
+    if parse_stats:
+        extra["throughput"] = parse_stats
+
+    output_path: str = osp.join(
+        results_dir,
+        f"{ref}/{short_name}.json" if ref != "master" else f"{short_name}.json",
+    )
+    if keywords or tags:
+        timings = merge_previous(
+            output_path, timings, extra, repo.head.commit.hexsha[:6], cython
+        )
     dump_info(
         repo,
         cython,
         timings,
         verbose,
-        osp.join(
-            results_dir,
-            f"{ref}/{short_name}.json" if ref != "master" else f"{short_name}.json",
-        ),
+        output_path,
+        extra,
     )
 
-    repo.git.checkout("master")
-
     return 0
 
 
-def setup_environment(verbose: int, cython: bool) -> int:
+def check_installed(repo) -> None:
+    """Make sure that mathics is imported from the checkout in `repo`, so the
+    timings are those of the commit checked out there.
+    """
+    if not osp.realpath(mathics.__file__).startswith(
+        osp.realpath(repo.working_dir) + os.sep
+    ):
+        raise click.ClickException(
+            f"mathics is imported from {osp.dirname(mathics.__file__)}, "
+            f"not from the checkout {repo.working_dir}"
+        )
+
+
+def setup_environment(
+    verbose: int, cython: bool, mathics_dir: Optional[str] = None
+) -> int:
     """
     Make sure Mathics core is set to the right place.
     We will basically run "pip install -e .".
+
+    `mathics_dir`: the mathics-core checkout to install. It defaults to
+    the "mathics-core" submodule.
     """
     command: list[str] = [sys.executable, "-m", "pip", "install", "-e", "."]
-    mathics_dir = osp.join(my_dir, "../", "mathics-core")
+    if mathics_dir is None:
+        mathics_dir = osp.join(my_dir, "../", "mathics-core")
 
     env: dict = {}
     if cython:
@@ -274,17 +453,354 @@ def setup_environment(verbose: int, cython: bool) -> int:
     return rc
 
 
-def run_benchmark(bench_data: dict, verbose: int, iterations: Optional[int]) -> dict:
+class GCMonitor:
+    """Record the garbage collections that happen while it is active, using
+    `gc.callbacks`. It can be activated several times, adding up the
+    collections.
+    """
+
+    def __init__(self):
+        self.collections: list[int] = [0, 0, 0]
+        self.pauses: list[float] = []
+        self.start: Optional[float] = None
+
+    def callback(self, phase: str, info: dict) -> None:
+        if phase == "start":
+            self.start = time.perf_counter()
+        elif self.start is not None:
+            self.pauses.append(time.perf_counter() - self.start)
+            self.collections[info["generation"]] += 1
+            self.start = None
+
+    def __enter__(self):
+        gc.callbacks.append(self.callback)
+        return self
+
+    def __exit__(self, *exc_info):
+        gc.callbacks.remove(self.callback)
+
+    def stats(self, elapsed_time: float) -> dict:
+        """Summarize the collections recorded over `elapsed_time` seconds."""
+        gc_time: float = sum(self.pauses)
+        return {
+            "Collections": self.collections,
+            "GC time": gc_time,
+            "GC fraction": gc_time / elapsed_time if elapsed_time else 0.0,
+            "Longest pause": max(self.pauses, default=0.0),
+        }
+
+
+def print_gc_stats(stats: dict) -> None:
+    print(
+        "    GC: %5.1f%% of the time, longest pause %1.6f secs, "
+        "collections by generation %s"
+        % (
+            stats["GC fraction"] * 100,
+            stats["Longest pause"],
+            "/".join(str(count) for count in stats["Collections"]),
+        )
+    )
+
+
+def run_gc_benchmarks(
+    bench_data: dict,
+    verbose: int,
+    iterations: Optional[int],
+    gc_thresholds: tuple,
+    parse_stats: Optional[dict] = None,
+) -> Tuple[dict, dict]:
+    """Run the benchmarks in `bench_data` recording garbage collections, first
+    with the current garbage collection thresholds and then with each of
+    `gc_thresholds`, tuples like (5000, 10, 10).
+
+    Return the timings of the first run, and a dictionary from threshold to
+    the timings and garbage collection data of that run. The parsing
+    throughput of the first run is added to `parse_stats` if it is given.
+    """
+    default_threshold: tuple = gc.get_threshold()
+    # Runs are keyed by their threshold, so a threshold given twice, or equal
+    # to the default one, is only run once.
+    thresholds: list[tuple] = list(dict.fromkeys([default_threshold, *gc_thresholds]))
+
+    runs: dict = {}
+    try:
+        for threshold in thresholds:
+            name = ",".join(str(value) for value in threshold)
+            if verbose:
+                print(f"Garbage collection threshold {name}")
+            gc.set_threshold(*threshold)
+            gc_stats: dict = {}
+            timings = run_benchmark(
+                bench_data,
+                verbose,
+                iterations,
+                gc_stats,
+                parse_stats if threshold == default_threshold else None,
+            )
+            runs[name] = {"timings": timings, "stats": gc_stats}
+    finally:
+        gc.set_threshold(*default_threshold)
+
+    print(
+        "%-20s %12s %12s %8s %14s"
+        % ("GC threshold", "secs", "GC secs", "GC %", "longest pause")
+    )
+    for name, run in runs.items():
+        elapsed_time = sum(
+            elapsed
+            for category in run["timings"].values()
+            for _, elapsed in category.values()
+        )
+        all_stats = [
+            stats for category in run["stats"].values() for stats in category.values()
+        ]
+        gc_time = sum(stats["GC time"] for stats in all_stats)
+        print(
+            "%-20s %12.6f %12.6f %7.1f%% %14.6f"
+            % (
+                name,
+                elapsed_time,
+                gc_time,
+                gc_time / elapsed_time * 100 if elapsed_time else 0.0,
+                max((stats["Longest pause"] for stats in all_stats), default=0.0),
+            )
+        )
+
+    return runs[",".join(str(value) for value in default_threshold)]["timings"], runs
+
+
+def python_timer(str_expr: str, namespace: dict, setup: str = "pass") -> timeit.Timer:
+    """Return a timer for the Python code in `str_expr` run in `namespace`.
+
+    The code is compiled once here, so that the timings don't include
+    compiling it, which can be far slower than running short statements.
+    """
+    code_object = compile(str_expr, "<bench>", "exec")
+    return timeit.Timer(
+        "_exec(_code, _namespace)",
+        setup,
+        globals={"_exec": exec, "_code": code_object, "_namespace": namespace},
+    )
+
+
+def run_python(str_expr: str, namespace: dict) -> None:
+    exec(compile(str_expr, "<setup>", "exec"), namespace)
+
+
+def resolve_callable(path: str, namespace: dict):
+    """Find the Python callable named by the dotted `path`.
+
+    The first component of `path` is looked up in `namespace`, so functions
+    defined or imported in "setup-exprs" can be used. Otherwise the longest
+    prefix of `path` which can be imported is imported, like in
+    "mathics.core.atoms.Integer1.get_int_value".
+
+    Callables are timed without arguments, so one which needs arguments is
+    rejected here, before any timing starts.
+    """
+    parts: list[str] = path.split(".")
+    if parts[0] in namespace:
+        obj = namespace[parts[0]]
+        attributes = parts[1:]
+    else:
+        for index in range(len(parts), 0, -1):
+            try:
+                obj = importlib.import_module(".".join(parts[:index]))
+            except ImportError:
+                continue
+            attributes = parts[index:]
+            break
+        else:
+            raise ImportError(f"Cannot find a module for {path}")
+
+    for attribute in attributes:
+        obj = getattr(obj, attribute)
+    if not callable(obj):
+        raise TypeError(f"{path} is not callable")
+    try:
+        signature = inspect.signature(obj)
+    except ValueError:
+        # Some builtins have no signature to check.
+        return obj
+    try:
+        signature.bind()
+    except TypeError:
+        raise TypeError(
+            f"{path} is called without arguments, but its signature is {signature}"
+        )
+    return obj
+
+
+def category_timers(
+    value: dict, python_mode: bool, session, namespace: dict, setup: str = "pass"
+):
+    """Yield the name and a timer for each expression of a category in turn.
+
+    Mathics expressions are parsed just before they are timed, after the
+    expressions before them have been evaluated. Callables are looked up
+    before anything is timed. `setup` is run by the timers before timing.
+    """
+    callables = [
+        (path, resolve_callable(path, namespace)) for path in value.get("callables", [])
+    ]
+    for str_expr in value.get("exprs", []):
+        if python_mode:
+            yield str_expr, python_timer(str_expr, namespace, setup)
+        else:
+            expr = parse(session.definitions, MathicsSingleLineFeeder(str_expr))
+            yield str_expr, timeit.Timer(
+                lambda: expr.evaluate(session.evaluation), setup
+            )
+
+    for path, function in callables:
+        yield path, timeit.Timer(function, setup)
+
+
+def parse_text(definitions, text: str, multi_line: bool) -> None:
+    """Parse all of `text`, as a file if `multi_line` is set."""
+    if multi_line:
+        feeder = MathicsMultiLineFeeder(text)
+        while not feeder.empty():
+            parse(definitions, feeder)
+    else:
+        parse(definitions, MathicsSingleLineFeeder(text))
+
+
+def count_tokens(text: str, multi_line: bool) -> int:
+    feeder = (
+        MathicsMultiLineFeeder(text) if multi_line else MathicsSingleLineFeeder(text)
+    )
+    tokens: int = 0
+    while not feeder.empty():
+        tokeniser = Tokeniser(feeder)
+        while tokeniser.next().tag != "END":
+            tokens += 1
+    return tokens
+
+
+def parse_inputs(value: dict) -> dict:
+    """The inputs of a "parse" category: its "exprs", then the ones made by
+    the generators in its "inputs", as a dictionary from name to
+    (name, text, multi_line).
+    """
+    inputs: list = [(str_expr, str_expr, False) for str_expr in value.get("exprs", [])]
+    for spec in value.get("inputs", []):
+        inputs += generate_inputs(spec)
+    return {parse_input[0]: parse_input for parse_input in inputs}
+
+
+def parse_timers(inputs, session, setup: str = "pass"):
+    """Yield the name and a timer parsing the text of each of `inputs`."""
+    for name, text, multi_line in inputs:
+        yield name, timeit.Timer(
+            lambda: parse_text(session.definitions, text, multi_line), setup
+        )
+
+
+def parse_throughput(session, inputs: list, seconds: float) -> dict:
+    """The throughput of parsing `inputs` in `seconds`, and the peak memory
+    allocated while parsing them once more.
+    """
+    size: int = sum(len(text.encode("utf-8")) for _, text, _ in inputs)
+    tokens: int = sum(count_tokens(text, multi_line) for _, text, multi_line in inputs)
+
+    tracemalloc.start()
+    try:
+        for _, text, multi_line in inputs:
+            parse_text(session.definitions, text, multi_line)
+        peak_memory: int = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "Bytes": size,
+        "Tokens": tokens,
+        "Bytes/sec": size / seconds if seconds else 0.0,
+        "Tokens/sec": tokens / seconds if seconds else 0.0,
+        "Peak memory": peak_memory,
+    }
+
+
+def print_throughput(stats: dict) -> None:
+    print(
+        "    %.0f bytes/sec, %.0f tokens/sec, peak memory %d bytes"
+        % (stats["Bytes/sec"], stats["Tokens/sec"], stats["Peak memory"])
+    )
+
+
+# Forms whose results are boxes; the others are converted to strings.
+BOX_FORMS = ("StandardForm", "TraditionalForm")
+
+
+def size_sweep(value: dict) -> list:
+    """The expressions of a category, with "{n}" replaced by each of its
+    "sizes" if it has them.
+    """
+    if "sizes" not in value:
+        return value["exprs"]
+    return [
+        str_expr.replace("{n}", str(size))
+        for str_expr in value["exprs"]
+        for size in value["sizes"]
+    ]
+
+
+def format_expression(result, form: str):
+    """The expression which converts the already evaluated `result` into
+    `form`: boxes for StandardForm and TraditionalForm, a string otherwise.
+    """
+    form_symbol = Symbol(f"System`{form}")
+    if form in BOX_FORMS:
+        # MakeBoxes holds its arguments, so `result` is not evaluated again.
+        return Expression(Symbol("System`MakeBoxes"), result, form_symbol)
+    return Expression(
+        Symbol("System`ToString"),
+        Expression(Symbol("System`Unevaluated"), result),
+        form_symbol,
+    )
+
+
+def format_timers(value: dict, session, setup: str = "pass"):
+    """Yield the name and a timer for converting the result of each
+    expression of a "forms" category into each of the forms.
+
+    Each expression is evaluated once before timing, so only the
+    formatting is timed.
+    """
+    for str_expr in size_sweep(value):
+        expr = parse(session.definitions, MathicsSingleLineFeeder(str_expr))
+        result = expr.evaluate(session.evaluation)
+        for form in value["forms"]:
+            formatter = format_expression(result, form)
+            yield f"{form}: {str_expr}", timeit.Timer(
+                lambda: formatter.evaluate(session.evaluation), setup
+            )
+
+
+def run_benchmark(
+    bench_data: dict,
+    verbose: int,
+    iterations: Optional[int],
+    gc_stats: Optional[dict] = None,
+    parse_stats: Optional[dict] = None,
+) -> dict:
     """Runs the expressions in `bench_data` to get timings and return the
     timings and number of runs associated with the data in a
     dictionary.
 
+    In Python mode, each category runs in its own copy of the namespace set
+    up by the top-level "setup-exprs".
+
+    If `gc_stats` is given, the garbage collector is left enabled while
+    timing, unlike what `timeit` does, and the garbage collections of each
+    timing are added to `gc_stats` like the timings.
+
     If `verbose` is set, show what's going on as it happens.
     """
     importlib.reload(mathics.session)
     session = mathics.session.MathicsSession(add_builtin=True, catch_interrupt=False)
 
-    console = code.InteractiveInterpreter()
+    namespace: dict = {"__name__": "__bench__"}
 
     # where we accumulate timings from the following loop
     timings: dict[dict[Tuple[int, float]]] = {}
@@ -292,68 +808,96 @@ def run_benchmark(bench_data: dict, verbose: int, iterations: Optional[int]) ->
     default_iterations: int = bench_data.get("iterations", 50)
     default_python_mode: bool = bench_data.get("python-mode", False)
 
+    timer_setup: str = "pass" if gc_stats is None else "import gc; gc.enable()"
+
     if "setup-exprs" in bench_data:
         for str_expr in bench_data["setup-exprs"]:
             if default_python_mode:
-                console.runcode(str_expr)
+                run_python(str_expr, namespace)
             else:
                 expr = parse(session.definitions, MathicsSingleLineFeeder(str_expr))
                 expr.evaluate(session.evaluation)
 
     for category, value in bench_data["categories"].items():
-        iterations: int = (
+        category_iterations: int = (
             int(iterations)
             if iterations
             else value.get("iterations", default_iterations)
         )
 
         python_mode: bool = value.get("python-mode", default_python_mode)
+        category_namespace: dict = dict(namespace)
 
         if verbose:
-            print(f"{iterations} iterations of {category}...")
+            print(f"{category_iterations} iterations of {category}...")
 
         timings[category] = {}
 
         if "setup-exprs" in value:
             for str_expr in value["setup-exprs"]:
                 if python_mode:
-                    console.runcode(str_expr)
+                    run_python(str_expr, category_namespace)
                 else:
                     expr = parse(session.definitions, MathicsSingleLineFeeder(str_expr))
                     expr.evaluate(session.evaluation)
 
+        if gc_stats is not None:
+            gc_stats[category] = {}
+
+        if value.get("parse"):
+            inputs = parse_inputs(value)
+            timers = parse_timers(inputs.values(), session, timer_setup)
+            if parse_stats is not None:
+                parse_stats[category] = {}
+        elif "forms" in value:
+            inputs = None
+            timers = format_timers(value, session, timer_setup)
+        else:
+            inputs = None
+            timers = category_timers(
+                value, python_mode, session, category_namespace, timer_setup
+            )
         if value.get("merge-exprs"):
             elapsed_time: float = 0
-            for str_expr in value["exprs"]:
-                if python_mode:
-                    elapsed_time += timeit.timeit(
-                        lambda: console.runcode(str_expr), number=iterations
-                    )
-                else:
-                    expr = parse(session.definitions, MathicsSingleLineFeeder(str_expr))
-                    elapsed_time += timeit.timeit(
-                        lambda: expr.evaluate(session.evaluation), number=iterations
-                    )
+            monitor = GCMonitor()
+            for _, timer in timers:
+                with monitor:
+                    elapsed_time += timer.timeit(number=category_iterations)
             if verbose:
                 print("  %1.6f secs for: %-40s" % (elapsed_time, category))
             # All expressions need a category, and these expressions should be
             # displayed with the name the of the category,
             # so timings[category][category].
-            timings[category][category] = (iterations, elapsed_time)
+            timings[category][category] = (category_iterations, elapsed_time)
+            if gc_stats is not None:
+                gc_stats[category][category] = monitor.stats(elapsed_time)
+                if verbose:
+                    print_gc_stats(gc_stats[category][category])
+            if inputs and parse_stats is not None:
+                parse_stats[category][category] = parse_throughput(
+                    session, list(inputs.values()), elapsed_time / category_iterations
+                )
+                if verbose:
+                    print_throughput(parse_stats[category][category])
         else:
-            for str_expr in value["exprs"]:
-                if python_mode:
-                    elapsed_time: float = timeit.timeit(
-                        lambda: console.runcode(str_expr), number=iterations
-                    )
-                else:
-                    expr = parse(session.definitions, MathicsSingleLineFeeder(str_expr))
-                    elapsed_time: float = timeit.timeit(
-                        lambda: expr.evaluate(session.evaluation), number=iterations
-                    )
+            for name, timer in timers:
+                with GCMonitor() as monitor:
+                    elapsed_time: float = timer.timeit(number=category_iterations)
                 if verbose:
-                    print("  %1.6f secs for: %-40s" % (elapsed_time, str_expr))
-                timings[category][str_expr] = (iterations, elapsed_time)
+                    print("  %1.6f secs for: %-40s" % (elapsed_time, name))
+                timings[category][name] = (category_iterations, elapsed_time)
+                if gc_stats is not None:
+                    gc_stats[category][name] = monitor.stats(elapsed_time)
+                    if verbose:
+                        print_gc_stats(gc_stats[category][name])
+                if inputs and parse_stats is not None:
+                    parse_stats[category][name] = parse_throughput(
+                        session,
+                        [inputs[name]],
+                        elapsed_time / category_iterations,
+                    )
+                    if verbose:
+                        print_throughput(parse_stats[category][name])
         if verbose:
             print()
     return timings
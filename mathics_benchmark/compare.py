@@ -31,6 +31,20 @@ The 3 options bellow are only useful when the benchmarks' results doesn't exist
 - Run all benchmarks against the SHA1 indicated in verbose mode:
   python ./mathics_benchmark/compare.py -v run-all b2e237c0aafd6fad08defc029332b5e328857a81
 
+- Compare a release, master and three feature branches, with the release as the baseline:
+  python ./mathics_benchmark/compare.py calculator-fns 4.0.0 master branch1 branch2 branch3 -b 4.0.0
+
+- Compare all benchmarks in batch mode: every result is loaded once, a summary of the
+  geometric-mean speedups over all the benchmarks is written and the plots are made in parallel:
+  python ./mathics_benchmark/compare.py --batch run-all 4.0.0 master branch1 -b 4.0.0
+
+With more than two git refs, or with --batch, the plots show the time of each ref and
+its speedup over the baseline: the baseline time divided by the time of the ref, so
+ratios above 1 are faster than the baseline. The baseline is the last ref unless -b is
+given. In this mode "compare-groups" is ignored. The plots and the summary go to
+"reports/<refs>_baseline-<baseline>"; the summary is "summary.txt" and "summary.json"
+for run-all, and "summary-<benchmark>" otherwise.
+
 If environment variable NO_CYTHON is set we skip running Cython in setting up mathics-core.
 
 If you installed mathics-benchmark, this file can be called as a binary, e.g.:
@@ -41,14 +55,18 @@ import numpy as np
 import matplotlib.pyplot as plt
 import json
 import click
+import glob
 import sys
 import re
 import os
 
 import os.path as osp
 
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
 from mathics_benchmark import bench
-from typing import Optional
+from mathics_benchmark.suite import SuiteError
+from typing import Optional, Tuple
 
 
 def break_string(string: str, number: int) -> str:
@@ -108,9 +126,25 @@ def break_string(string: str, number: int) -> str:
     "--iterations",
     help="Override the number of iterations",
 )
+@click.option(
+    "-b",
+    "--baseline",
+    help="The git ref the others are compared to. The default is the last ref.",
+)
+@click.option(
+    "--batch",
+    help="Load all the results once, write a summary of the speedups and make the plots in parallel",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    help="The number of processes making plots in batch mode. The default is the number of CPUs.",
+)
 @click.argument("input", nargs=1, type=click.Path(readable=True), required=True)
 @click.argument("ref1", nargs=1, type=click.Path(readable=True), required=True)
-@click.argument("ref2", nargs=1, type=click.Path(readable=True), default="master")
+@click.argument("refs", nargs=-1, type=click.Path(readable=True))
 def main(
     verbose: int,
     group: Optional[str],
@@ -120,31 +154,67 @@ def main(
     single: bool,
     logarithmic: Optional[bool],
     cython: Optional[bool],
+    baseline: Optional[str],
+    batch: bool,
+    jobs: Optional[int],
     input: str,
     ref1: str,
-    ref2: str,
+    refs: tuple,
     iterations: Optional[int],
 ):
-    if input == "run-all":
-        import glob
+    all_refs: list[str] = [ref1, *refs] if refs else [ref1, "master"]
+    if baseline is None:
+        baseline = all_refs[-1]
+    elif baseline not in all_refs:
+        all_refs.append(baseline)
+
+    if batch or len(all_refs) > 2 or baseline != all_refs[-1]:
+        inputs = (
+            sorted(osp.basename(path) for path in glob.glob("benchmarks/*.yaml"))
+            if input == "run-all"
+            else [input]
+        )
+        batch_report(
+            verbose,
+            group,
+            clean,
+            pull,
+            force,
+            logarithmic,
+            cython,
+            iterations,
+            inputs,
+            all_refs,
+            baseline,
+            jobs,
+            "summary"
+            if input == "run-all"
+            else f"summary-{osp.splitext(osp.basename(input))[0]}",
+        )
+        return
 
+    ref2: str = all_refs[1]
+    if input == "run-all":
         inputs = glob.glob("benchmarks/*.yaml")
         for input in inputs:
             print(f"running {input[11:]}")
-            worker(
-                verbose,
-                group,
-                clean,
-                pull,
-                force,
-                single,
-                logarithmic,
-                cython,
-                iterations,
-                input[11:],
-                ref1,
-                ref2,
-            )
+            try:
+                worker(
+                    verbose,
+                    group,
+                    clean,
+                    pull,
+                    force,
+                    single,
+                    logarithmic,
+                    cython,
+                    iterations,
+                    input[11:],
+                    ref1,
+                    ref2,
+                )
+            except SuiteError as e:
+                print(f"skipping {input[11:]}: {e}")
     else:
         worker(
             verbose,
@@ -446,5 +516,271 @@ def worker(
     plt.savefig(filename)
 
 
+def result_path(input: str, ref: str) -> str:
+    return f"results/{input}.json" if ref == "master" else f"results/{ref}/{input}.json"
+
+
+def ensure_results(
+    verbose: int,
+    pull: bool,
+    force: bool,
+    cython: Optional[bool],
+    iterations: Optional[int],
+    input: str,
+    ref: str,
+) -> str:
+    """Run the benchmark `input` at `ref` unless its results already exist
+    and return the path of the results.
+
+    mathics-bench installs `ref` and times it in a new process, so each ref
+    is timed with its own build even though they all run from here.
+    """
+    path = result_path(input, ref)
+    if not osp.isfile(path) or force:
+        arguments = [input, ref]
+
+        if pull:
+            arguments.append("-p")
+
+        if verbose:
+            arguments.append("-v")
+
+        if cython is True:
+            arguments.append("--cython")
+        elif cython is False:
+            arguments.append("--no-cython")
+
+        if iterations:
+            arguments.append("-i")
+            arguments.append(iterations)
+
+        rc = bench.main(arguments, standalone_mode=False)
+        if rc or not osp.isfile(path):
+            raise click.ClickException(f"Running {input} at {ref} failed")
+    return path
+
+
+def load_results(path: str, group: Optional[str]) -> Tuple[str, dict]:
+    """Read the results in `path`. Return the git SHA they were run at and a
+    dictionary from (group, query) to the time of one iteration.
+
+    If `group` is given only the queries of that group are read.
+    """
+    with open(path) as file:
+        object = json.load(file)
+
+    timings: dict = object["timings"]
+    times: dict = {}
+    for queries_group in [group] if group else timings:
+        for query, (iterations, elapsed) in timings.get(queries_group, {}).items():
+            times[(queries_group, query)] = elapsed / iterations
+    return object["info"]["Git SHA"], times
+
+
+def geometric_mean(ratios: np.ndarray) -> np.ndarray:
+    """The geometric mean along the last axis of `ratios`, ignoring NaN."""
+    return np.exp(np.nanmean(np.log(ratios), axis=-1))
+
+
+def batch_report(
+    verbose: int,
+    group: Optional[str],
+    clean: Optional[bool],
+    pull: bool,
+    force: bool,
+    logarithmic: Optional[bool],
+    cython: Optional[bool],
+    iterations: Optional[int],
+    inputs: list,
+    refs: list,
+    baseline: str,
+    jobs: Optional[int],
+    summary_name: str = "summary",
+):
+    """Compare `refs` against `baseline` on every benchmark in `inputs`.
+
+    All results are loaded first, running the benchmarks that are missing.
+    Then the geometric mean of the speedups over the baseline is printed for
+    each benchmark, and overall as the geometric mean over the benchmarks.
+    Finally the plots are made in `jobs` parallel processes.
+
+    The summary is written to "reports/<refs>_baseline-<baseline>/", in
+    files named `summary_name`, so that runs over other benchmarks or
+    against another baseline don't overwrite it.
+    """
+    folder: str = f"{'_vs_'.join(refs)}_baseline-{baseline}"
+    if group:
+        summary_name += f"-{group}"
+    baseline_index: int = refs.index(baseline)
+    plots: list[tuple] = []
+    summary: dict = {}
+
+    # Running a benchmark checks out mathics-core, so this part is sequential.
+    for input in inputs:
+        if input[-5:] == ".yaml":
+            input = input[:-5]
+        if verbose:
+            print(f"loading {input}")
+
+        try:
+            yaml_file: dict = bench.get_bench_data(input)
+        except SuiteError as e:
+            print(f"skipping {input}: {e}")
+            continue
+
+        shas: list[str] = []
+        results: list[dict] = []
+        for ref in refs:
+            path = ensure_results(verbose, pull, force, cython, iterations, input, ref)
+            sha, times = load_results(path, group)
+            shas.append(sha)
+            results.append(times)
+
+        keys = list(dict.fromkeys(key for times in results for key in times))
+        if not keys:
+            continue
+
+        times = np.array(
+            [[result.get(key, np.nan) for key in keys] for result in results]
+        )
+        # The speedup of each ref: above 1 is faster than the baseline.
+        speedups = times[baseline_index] / times
+        summary[input] = geometric_mean(speedups)
+
+        plots.append(
+            (
+                input,
+                refs,
+                baseline,
+                shas,
+                [query for _, query in keys],
+                times,
+                speedups,
+                yaml_file.get("clean", False) if clean is None else clean,
+                yaml_file.get("logarithmic", False)
+                if logarithmic is None
+                else logarithmic,
+                f"reports/{folder}/report-{input}.png",
+            )
+        )
+
+    os.makedirs(f"reports/{folder}", exist_ok=True)
+
+    if summary:
+        overall = geometric_mean(np.array(list(summary.values())).T)
+        lines = [
+            f"Geometric-mean speedup over {baseline} (above 1 is faster)",
+            "".join([f"{'':30}"] + [f"{ref[:14]:>15}" for ref in refs]),
+        ]
+        for input, speedups in [*summary.items(), ("(all benchmarks)", overall)]:
+            lines.append(
+                "".join(
+                    [f"{input[:30]:30}"] + [f"{speedup:15.3f}" for speedup in speedups]
+                )
+            )
+        print("\n".join(lines))
+
+        with open(f"reports/{folder}/{summary_name}.txt", "w") as file:
+            file.write("\n".join(lines) + "\n")
+        with open(f"reports/{folder}/{summary_name}.json", "w") as file:
+            json.dump(
+                {
+                    "baseline": baseline,
+                    "refs": refs,
+                    "speedups": {
+                        input: dict(zip(refs, speedups.tolist()))
+                        for input, speedups in summary.items()
+                    },
+                    "overall": dict(zip(refs, overall.tolist())),
+                },
+                file,
+                indent=2,
+            )
+
+    if len(plots) == 1:
+        plot_nway(*plots[0])
+    elif plots:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for filename in executor.map(plot_nway, *zip(*plots)):
+                if verbose:
+                    print(f"wrote {filename}")
+
+
+def plot_nway(
+    input: str,
+    refs: list,
+    baseline: str,
+    shas: list,
+    queries: list,
+    times: np.ndarray,
+    speedups: np.ndarray,
+    clean: bool,
+    logarithmic: bool,
+    filename: str,
+) -> str:
+    """Plot the `times` of each ref in `refs` for `queries`, labelled with
+    the speedup over `baseline` unless `clean` is set, and save the plot in
+    `filename`.
+
+    This only uses its arguments, so that it can run in another process.
+    """
+    labels = [
+        break_string(query, 25 if index <= 10 else 35)
+        for index, query in enumerate(queries)
+    ]
+
+    x = np.arange(len(queries))  # label locations
+    width = 0.8 / len(refs)  # width of the bars
+
+    fig = Figure(figsize=(6.4, max(4.8, 0.1 * len(queries) * len(refs))))
+    ax = fig.subplots()
+    ax.set_xlabel("seconds")
+    ax.set_title(input)
+    ax.set_yticks(x)
+
+    if logarithmic:
+        ax.set_xscale("log")
+
+    for index, ref in enumerate(refs):
+        rects = ax.barh(
+            # In matplotlib y=0 is the bottom of the plot, so the first ref
+            # is on top.
+            x + ((len(refs) - 1) / 2 - index) * width,
+            times[index],
+            width,
+            label=f"{ref} - {shas[index]}" + (" (baseline)" if ref == baseline else ""),
+        )
+
+        if clean or ref == baseline:
+            continue
+
+        # Only show the speedups which are greater than 1%.
+        for color, shown in (
+            ("green", lambda speedup: speedup > 1.01),
+            ("red", lambda speedup: speedup < 0.99),
+        ):
+            ax.bar_label(
+                rects,
+                labels=[
+                    f"x{speedup:.2f}" if shown(speedup) else ""
+                    for speedup in speedups[index]
+                ],
+                color=color,
+                fontsize="small",
+            )
+
+    ax.set_yticklabels(
+        labels,
+        fontdict={
+            "fontsize": "large" if len(queries) <= 10 else 6,
+        },
+    )
+    ax.legend()
+
+    fig.tight_layout()
+    fig.savefig(filename)
+    return filename
+
+
 if __name__ == "__main__":
     main(sys.argv[1:])
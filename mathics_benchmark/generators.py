@@ -0,0 +1,84 @@
+"""
+Generators of large Mathics inputs for the "parse" categories of the
+benchmarks. Each generator takes a size and returns the text of an input
+which grows linearly with that size.
+
+In a YAML file they are used like this:
+
+    inputs:
+      - generator: operator-chain
+        operator: "*"
+        sizes: [1000, 10000]
+"""
+
+from typing import Callable, Dict, Tuple
+
+
+def long_list(size: int) -> str:
+    """{0, 1, 2, ...} with `size` elements."""
+    return "{" + ", ".join(str(i) for i in range(size)) + "}"
+
+
+def nested_call(size: int) -> str:
+    """f[f[f[...x...]]] nested `size` times."""
+    return "f[" * size + "x" + "]" * size
+
+
+def nested_list(size: int) -> str:
+    """{{{...1...}}} nested `size` times."""
+    return "{" * size + "1" + "}" * size
+
+
+def operator_chain(size: int, operator: str = "+") -> str:
+    """a0 + a1 + a2 + ... with `size` operands."""
+    return f" {operator} ".join(f"a{i}" for i in range(size))
+
+
+def big_string(size: int) -> str:
+    """A string literal of `size` characters, with some escapes in it."""
+    chunk = 'abc def \\"ghi\\" \\n jkl '
+    return '"' + (chunk * (size // len(chunk) + 1))[:size].rstrip("\\") + '"'
+
+
+def multi_line(size: int) -> str:
+    """A file with `size` lines of definitions, some of them split across
+    several lines.
+    """
+    lines = []
+    for i in range(size):
+        if i % 10 == 0:
+            lines.append(f"g{i}[x_, y_] :=\n  Module[{{z = x + {i}}},\n    z^2 + y]")
+        else:
+            lines.append(f"f{i}[x_] := x^{i % 7} + {i} (* definition {i} *)")
+    return "\n".join(lines) + "\n"
+
+
+# Name used in YAML files -> (generator, whether the input is multi-line).
+GENERATORS: Dict[str, Tuple[Callable, bool]] = {
+    "long-list": (long_list, False),
+    "nested-call": (nested_call, False),
+    "nested-list": (nested_list, False),
+    "operator-chain": (operator_chain, False),
+    "big-string": (big_string, False),
+    "multi-line": (multi_line, True),
+}
+
+
+def generate_inputs(spec: dict) -> list:
+    """Expand an entry of "inputs" in a YAML file into (name, text,
+    multi_line) triples, one for each of its sizes.
+
+    The keys of `spec` other than "generator", "sizes" and "name" are passed
+    to the generator.
+    """
+    generator, multi_line = GENERATORS[spec["generator"]]
+    options = {
+        key: value
+        for key, value in spec.items()
+        if key not in ("generator", "sizes", "name")
+    }
+    name = spec.get("name", spec["generator"])
+    return [
+        (f"{name} {size}", generator(size, **options), multi_line)
+        for size in spec["sizes"]
+    ]
@@ -0,0 +1,684 @@
+#!/usr/bin/env python3
+
+"""
+Split benchmark runs across several benchmark machines, or several worker
+processes on one machine, through a job queue kept in a SQLite database.
+
+A job is a single (ref, suite, category) triple. A coordinator splits the
+suites to run into jobs, worker agents pull jobs from the queue, run them with
+the same code that mathics-bench uses, and send back the timings together with
+the fingerprint of the machine they ran on. Finally the coordinator collects
+the finished jobs into the usual files under "results", so
+mathics-bench-compare can plot them as if they had been run locally.
+
+Examples:
+- Queue the "calculator-fns" and "Part" suites for master and quickpatterntest:
+  python ./mathics_benchmark/jobqueue.py submit calculator-fns Part -r master -r quickpatterntest
+- Queue all the suites in the "benchmarks" directory for a SHA1:
+  python ./mathics_benchmark/jobqueue.py submit run-all -r b2e237c0aafd6fad08defc029332b5e328857a81
+- Run a worker until the queue is empty:
+  python ./mathics_benchmark/jobqueue.py work
+- Run a worker on its own mathics-core checkout, waiting for new jobs:
+  python ./mathics_benchmark/jobqueue.py work --repo /srv/mathics-core --wait
+- Show how many jobs are in each state:
+  python ./mathics_benchmark/jobqueue.py status
+- Write the results of the finished jobs:
+  python ./mathics_benchmark/jobqueue.py collect
+
+The queue is "results/jobs.sqlite" unless --queue is given. To use workers on
+several machines, put the queue in a shared directory which supports file
+locking.
+
+Each worker checks out the ref of its job and installs it with
+"pip install -e", so every worker needs its own mathics-core checkout and
+its own Python environment; a worker refuses to start on a checkout or an
+environment another worker is using. To run several workers on one machine,
+give each one a worktree and a virtual environment, e.g.:
+  git -C mathics-core worktree add /srv/worker-1
+  python -m venv /srv/venv-1 && /srv/venv-1/bin/pip install -e .
+  /srv/venv-1/bin/mathics-bench-queue work --repo /srv/worker-1
+Workers prefer jobs for the ref they already have installed. Each job runs
+in a new Python process, so that it imports the mathics-core just installed.
+
+If you installed mathics-benchmark, this file can be called as a binary, e.g.:
+- mathics-bench-queue status
+"""
+
+from typing import Optional, Tuple
+
+import click
+import glob
+import hashlib
+import json
+import os
+import os.path as osp
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows; workers are not locked there.
+    fcntl = None
+
+from mathics_benchmark import bench
+from mathics_benchmark.suite import SuiteError
+
+
+default_queue_path = osp.join(bench.my_dir, "..", "results", "jobs.sqlite")
+
+# Jobs which have been running for longer than this number of seconds are
+# assumed to belong to a dead worker and are given to another worker.
+default_stale_timeout = 6 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch INTEGER NOT NULL,
+    ref TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    category TEXT NOT NULL,
+    iterations INTEGER,
+    cython INTEGER,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    claimed_at REAL,
+    finished_at REAL,
+    timings TEXT,
+    info TEXT,
+    throughput TEXT,
+    error TEXT
+)
+"""
+
+
+def connect(queue_path: str = default_queue_path) -> sqlite3.Connection:
+    """Open the job queue in `queue_path`, creating it if needed.
+
+    Transactions are handled explicitly, so that claiming a job is atomic
+    even when many workers share the queue.
+    """
+    connection = sqlite3.connect(queue_path, timeout=60, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute(SCHEMA)
+    # Queues made before the parsing throughput was recorded lack its column.
+    columns = [row["name"] for row in connection.execute("PRAGMA table_info(jobs)")]
+    if "throughput" not in columns:
+        connection.execute("ALTER TABLE jobs ADD COLUMN throughput TEXT")
+    return connection
+
+
+def suite_name(config: str) -> str:
+    """The name under which the results of `config` are stored."""
+    name = osp.basename(config)
+    if name.endswith(".yaml"):
+        name = name[: -len(".yaml")]
+    return name
+
+
+def result_path(results_dir: str, ref: str, suite: str) -> str:
+    """The path where mathics-bench writes the results of `suite` at `ref`."""
+    if ref == "master":
+        return osp.join(results_dir, f"{suite}.json")
+    return osp.join(results_dir, ref, f"{suite}.json")
+
+
+def expand_suites(configs: list) -> list:
+    """The names of the suites in `configs`, where "run-all" stands for every
+    suite in the "benchmarks" directory.
+    """
+    suites: list[str] = []
+    for config in configs:
+        if config == "run-all":
+            suites += sorted(
+                suite_name(path)
+                for path in glob.glob(
+                    osp.join(bench.my_dir, "..", "benchmarks", "*.yaml")
+                )
+            )
+        else:
+            suites.append(suite_name(config))
+    return suites
+
+
+def split_jobs(configs: list, refs: list) -> list:
+    """Split every suite in `configs` into (ref, suite, category) jobs for each
+    ref in `refs`. "run-all" stands for every suite in the "benchmarks"
+    directory. Suites which cannot be loaded are skipped.
+    """
+    jobs: list[tuple[str, str, str]] = []
+    for suite in expand_suites(configs):
+        try:
+            categories = bench.get_bench_data(suite).get("categories", {})
+        except SuiteError as e:
+            print(f"skipping {suite}: {e}")
+            continue
+        for ref in refs:
+            for category in categories:
+                jobs.append((ref, suite, category))
+    return jobs
+
+
+def submit_jobs(
+    connection: sqlite3.Connection,
+    jobs: list,
+    iterations: Optional[int],
+    cython: Optional[bool],
+) -> int:
+    """Queue `jobs` as a new batch and return the number of jobs queued.
+
+    Jobs which are already waiting or running in the queue are not queued
+    again.
+    """
+    submitted: int = 0
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        batch: int = connection.execute(
+            "SELECT COALESCE(MAX(batch), 0) + 1 FROM jobs"
+        ).fetchone()[0]
+        for ref, suite, category in jobs:
+            if connection.execute(
+                "SELECT 1 FROM jobs WHERE ref = ? AND suite = ? AND category = ?"
+                " AND state IN ('pending', 'running')",
+                (ref, suite, category),
+            ).fetchone():
+                continue
+            connection.execute(
+                "INSERT INTO jobs (batch, ref, suite, category, iterations, cython)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    batch,
+                    ref,
+                    suite,
+                    category,
+                    iterations,
+                    None if cython is None else int(cython),
+                ),
+            )
+            submitted += 1
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return submitted
+
+
+def claim_job(
+    connection: sqlite3.Connection,
+    worker: str,
+    current_ref: Optional[str] = None,
+    stale_timeout: float = default_stale_timeout,
+) -> Optional[sqlite3.Row]:
+    """Atomically take the next pending job for `worker`, or return None when
+    there is no pending job.
+
+    Jobs for `current_ref`, the ref the worker has installed, come first so
+    that the worker does not have to reinstall mathics-core.
+    """
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "UPDATE jobs SET state = 'pending', worker = NULL, claimed_at = NULL"
+            " WHERE state = 'running' AND claimed_at < ?",
+            (now - stale_timeout,),
+        )
+        job = connection.execute(
+            "SELECT * FROM jobs WHERE state = 'pending'"
+            " ORDER BY ref = ? DESC, id LIMIT 1",
+            (current_ref,),
+        ).fetchone()
+        if job is not None:
+            connection.execute(
+                "UPDATE jobs SET state = 'running', worker = ?, claimed_at = ?"
+                " WHERE id = ?",
+                (worker, now, job["id"]),
+            )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return job
+
+
+def finish_job(
+    connection: sqlite3.Connection,
+    job_id: int,
+    timings: dict,
+    info: dict,
+    throughput: Optional[dict] = None,
+) -> None:
+    """Record the `timings` of a job, the `info` of the machine that ran it
+    and, for a "parse" category, its parsing `throughput`.
+    """
+    connection.execute(
+        "UPDATE jobs SET state = 'done', finished_at = ?, timings = ?, info = ?,"
+        " throughput = ? WHERE id = ?",
+        (
+            time.time(),
+            json.dumps(timings),
+            json.dumps(info),
+            json.dumps(throughput) if throughput else None,
+            job_id,
+        ),
+    )
+
+
+def fail_job(connection: sqlite3.Connection, job_id: int, error: str) -> None:
+    """Record that a job could not be run, and why."""
+    connection.execute(
+        "UPDATE jobs SET state = 'failed', finished_at = ?, error = ? WHERE id = ?",
+        (time.time(), error, job_id),
+    )
+
+
+class Worker:
+    """A worker agent: it pulls jobs from a queue and runs them on a
+    mathics-core checkout, keeping track of what is installed so that
+    consecutive jobs on the same ref are not reinstalled.
+    """
+
+    def __init__(
+        self,
+        connection: sqlite3.Connection,
+        name: str,
+        repo_path: str = bench.default_git_repo,
+        verbose: int = 0,
+    ):
+        self.connection = connection
+        self.name = name
+        self.repo = bench.setup_git(repo_path)
+        self.verbose = verbose
+        # The (ref, cython) pair currently installed.
+        self.installed: Optional[Tuple[str, bool]] = None
+
+    def lock(self) -> list:
+        """Lock the mathics-core checkout and the Python environment of this
+        worker, so that no other worker checks out or installs a different
+        ref under it. Return the lock files, which hold the locks while open.
+        """
+        if fcntl is None:
+            return []
+        environment = hashlib.sha1(sys.prefix.encode("utf-8")).hexdigest()[:12]
+        locks = []
+        for what, path, lock_path in [
+            (
+                "mathics-core checkout",
+                self.repo.working_dir,
+                osp.join(self.repo.git_dir, "mathics-bench-worker.lock"),
+            ),
+            (
+                "Python environment",
+                sys.prefix,
+                osp.join(
+                    tempfile.gettempdir(), f"mathics-bench-worker-{environment}.lock"
+                ),
+            ),
+        ]:
+            lock_file = open(lock_path, "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                for held in locks:
+                    held.close()
+                raise RuntimeError(
+                    f"Another worker is using the {what} {path}; "
+                    "each worker needs its own"
+                )
+            locks.append(lock_file)
+        return locks
+
+    def prepare(self, ref: str, cython: bool) -> None:
+        if self.installed == (ref, cython):
+            return
+        self.repo.git.checkout(ref)
+        rc = bench.setup_environment(self.verbose, cython, self.repo.working_dir)
+        if rc != 0:
+            self.installed = None
+            raise RuntimeError(f"installing mathics-core at {ref} failed with {rc}")
+        self.installed = (ref, cython)
+
+    def run_job(self, job: sqlite3.Row) -> Tuple[dict, dict, dict]:
+        """Run a single job and return its timings, the machine information
+        and the parsing throughput.
+        """
+        bench_data: dict = bench.get_bench_data(job["suite"])
+        cython: bool = (
+            bool(job["cython"])
+            if job["cython"] is not None
+            else bench_data.get("cython", False)
+        )
+        self.prepare(job["ref"], cython)
+
+        # This process keeps the mathics-core it imported when it started,
+        # so the job runs in a new one, which imports the one just installed.
+        with tempfile.TemporaryDirectory() as directory:
+            output = osp.join(directory, "job.json")
+            command = [sys.executable, "-m", "mathics_benchmark.jobqueue"]
+            if self.verbose:
+                command.append("-" + "v" * self.verbose)
+            command += ["run-job", "--repo", self.repo.working_dir, "-o", output]
+            if job["iterations"]:
+                command += ["-i", str(job["iterations"])]
+            if cython:
+                command.append("--cython")
+            command += [job["suite"], job["category"]]
+
+            completed_process = subprocess.run(
+                command,
+                cwd=osp.join(bench.my_dir, ".."),
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            if completed_process.returncode != 0 or not osp.isfile(output):
+                raise RuntimeError(
+                    f"The job failed with return code {completed_process.returncode}:\n"
+                    f"{completed_process.stderr}"
+                )
+            with open(output) as file:
+                result: dict = json.load(file)
+
+        info: dict = result["info"]
+        info["Worker"] = self.name
+        info["Host"] = platform.node()
+        return result["timings"], info, result.get("throughput", {})
+
+    def run(self, wait: bool = False, poll_interval: float = 10) -> int:
+        """Run jobs until the queue is empty, or forever if `wait` is set.
+        Return the number of jobs run.
+        """
+        done: int = 0
+        locks = self.lock()
+        try:
+            while True:
+                current_ref = self.installed[0] if self.installed else None
+                job = claim_job(self.connection, self.name, current_ref)
+                if job is None:
+                    if not wait:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                if self.verbose:
+                    print(f"{self.name}: {job['ref']} {job['suite']} {job['category']}")
+                try:
+                    timings, info, throughput = self.run_job(job)
+                except Exception:
+                    fail_job(self.connection, job["id"], traceback.format_exc())
+                    if self.verbose:
+                        print(f"{self.name}: job {job['id']} failed")
+                    continue
+                finish_job(self.connection, job["id"], timings, info, throughput)
+                done += 1
+        finally:
+            if self.installed is not None:
+                self.repo.git.checkout("master")
+            for lock_file in locks:
+                lock_file.close()
+        return done
+
+
+def collect(connection: sqlite3.Connection, results_dir: str, verbose: int = 0) -> list:
+    """Write the results of every (ref, suite) whose jobs have all finished,
+    in the format written by mathics-bench, with the parsing throughput of
+    the "parse" categories. Return the paths written.
+
+    The jobs of a (ref, suite) are collected together across batches, since
+    a batch leaves out the jobs that an earlier batch still had queued, and
+    only once none of them is waiting, running or failed. When a category
+    was run several times the latest run is used.
+
+    The "info" of the result is the one of the worker that ran the first
+    category; "Workers" records which worker ran each category.
+    """
+    written: list[str] = []
+    groups = connection.execute(
+        "SELECT ref, suite FROM jobs WHERE state != 'collected'"
+        " GROUP BY ref, suite"
+        " HAVING SUM(state != 'done') = 0"
+    ).fetchall()
+    for group in groups:
+        jobs = connection.execute(
+            "SELECT * FROM jobs WHERE ref = ? AND suite = ? AND state = 'done'"
+            " ORDER BY id",
+            (group["ref"], group["suite"]),
+        ).fetchall()
+
+        timings: dict = {}
+        throughput: dict = {}
+        workers: dict = {}
+        info: Optional[dict] = None
+        for job in jobs:
+            timings.update(json.loads(job["timings"]))
+            if job["throughput"]:
+                throughput.update(json.loads(job["throughput"]))
+            job_info = json.loads(job["info"])
+            workers[job["category"]] = job_info.get("Worker")
+            if info is None:
+                info = job_info
+        info["Workers"] = workers
+
+        path = result_path(results_dir, group["ref"], group["suite"])
+        result: dict = {"timings": timings, "info": info}
+        if throughput:
+            result["throughput"] = throughput
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(result, file)
+        if verbose:
+            print(f"Wrote {path}")
+        written.append(path)
+
+        connection.execute(
+            "UPDATE jobs SET state = 'collected'"
+            " WHERE ref = ? AND suite = ? AND state = 'done'",
+            (group["ref"], group["suite"]),
+        )
+    return written
+
+
+@click.group()
+@click.option(
+    "-q",
+    "--queue",
+    help="The SQLite file holding the job queue.",
+    type=click.Path(),
+    default=default_queue_path,
+)
+@click.option(
+    "-v",
+    "--verbose",
+    count=True,
+    help="verbosity level in tracing.\n"
+    "Can be supplied multiple times to increase verbosity.",
+)
+@click.pass_context
+def main(ctx, queue: str, verbose: int):
+    """Distribute benchmark runs over worker agents through a job queue."""
+    ctx.obj = {"queue": queue, "verbose": verbose}
+
+
+@main.command()
+@click.option(
+    "-r",
+    "--ref",
+    "refs",
+    multiple=True,
+    help="A git reference to benchmark. Can be supplied multiple times.",
+)
+@click.option(
+    "--cython/--no-cython",
+    help="Run Cython on setup. The default is what the YAML file says.",
+    default=None,
+)
+@click.option(
+    "-i",
+    "--iterations",
+    type=int,
+    help="Override the number of iterations",
+)
+@click.argument("configs", nargs=-1, required=True)
+@click.pass_context
+def submit(
+    ctx, refs: tuple, cython: Optional[bool], iterations: Optional[int], configs: tuple
+):
+    """Split the suites in CONFIGS into jobs and queue them.
+
+    "run-all" stands for every suite in the "benchmarks" directory.
+    REFS defaults to "master".
+    """
+    jobs = split_jobs(list(configs), list(refs) or ["master"])
+    submitted = submit_jobs(connect(ctx.obj["queue"]), jobs, iterations, cython)
+    print(f"Queued {submitted} of {len(jobs)} jobs")
+
+
+@main.command()
+@click.option(
+    "-n",
+    "--name",
+    help="The name of this worker. The default is the host name and process id.",
+)
+@click.option(
+    "--repo",
+    help="The mathics-core checkout this worker runs jobs on.",
+    type=click.Path(exists=True, file_okay=False),
+    default=bench.default_git_repo,
+)
+@click.option(
+    "-p",
+    "--pull",
+    help="Update the mathics-core repository before running jobs",
+    is_flag=True,
+)
+@click.option(
+    "-w",
+    "--wait",
+    help="Wait for new jobs instead of stopping when the queue is empty",
+    is_flag=True,
+)
+@click.option(
+    "--poll-interval",
+    type=float,
+    default=10,
+    help="Seconds between checks for new jobs with --wait",
+)
+@click.pass_context
+def work(
+    ctx, name: Optional[str], repo: str, pull: bool, wait: bool, poll_interval: float
+):
+    """Run jobs from the queue."""
+    if name is None:
+        name = f"{platform.node()}-{os.getpid()}"
+    worker = Worker(connect(ctx.obj["queue"]), name, repo, ctx.obj["verbose"])
+    if pull:
+        worker.repo.remotes.origin.pull()
+    try:
+        done = worker.run(wait, poll_interval)
+    except RuntimeError as e:
+        print(f"{name}: {e}")
+        return 1
+    print(f"{name}: ran {done} jobs")
+
+
+@main.command("run-job", hidden=True)
+@click.option(
+    "--repo",
+    help="The mathics-core checkout the job runs on.",
+    type=click.Path(exists=True, file_okay=False),
+    default=bench.default_git_repo,
+)
+@click.option(
+    "-i",
+    "--iterations",
+    type=int,
+    help="Override the number of iterations",
+)
+@click.option("--cython", is_flag=True, help="Whether Cython was run on setup")
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False),
+    required=True,
+    help="Where to write the timings and the machine information",
+)
+@click.argument("suite")
+@click.argument("category")
+@click.pass_context
+def run_job_command(
+    ctx,
+    repo: str,
+    iterations: Optional[int],
+    cython: bool,
+    output: str,
+    suite: str,
+    category: str,
+):
+    """Run CATEGORY of SUITE on the mathics-core installed from REPO.
+
+    Workers run each job with this command in a new process.
+    """
+    bench.check_installed(bench.setup_git(repo))
+
+    bench_data: dict = bench.get_bench_data(suite)
+    category_data = dict(bench_data)
+    category_data["categories"] = {category: bench_data["categories"][category]}
+    parse_stats: dict = {}
+    timings = bench.run_benchmark(
+        category_data, ctx.obj["verbose"], iterations, None, parse_stats
+    )
+
+    info = bench.get_info(bench.setup_git(repo), cython)
+    with open(output, "w") as file:
+        json.dump({"timings": timings, "info": info, "throughput": parse_stats}, file)
+
+
+@main.command()
+@click.pass_context
+def status(ctx):
+    """Show the number of jobs in each state, and the failed jobs."""
+    connection = connect(ctx.obj["queue"])
+    for row in connection.execute(
+        "SELECT state, COUNT(*) AS count FROM jobs GROUP BY state ORDER BY state"
+    ):
+        print(f"{row['state']:10} {row['count']}")
+    for row in connection.execute("SELECT * FROM jobs WHERE state = 'failed'"):
+        print(
+            f"failed: {row['ref']} {row['suite']} {row['category']} ({row['worker']})"
+        )
+        if ctx.obj["verbose"]:
+            print(row["error"])
+
+
+@main.command()
+@click.pass_context
+def requeue(ctx):
+    """Queue again the jobs that failed."""
+    cursor = connect(ctx.obj["queue"]).execute(
+        "UPDATE jobs SET state = 'pending', worker = NULL, claimed_at = NULL,"
+        " error = NULL WHERE state = 'failed'"
+    )
+    print(f"Requeued {cursor.rowcount} jobs")
+
+
+@main.command("collect")
+@click.option(
+    "--results-dir",
+    type=click.Path(file_okay=False),
+    default=osp.join(bench.my_dir, "..", "results"),
+    help="Where to write the results",
+)
+@click.pass_context
+def collect_command(ctx, results_dir: str):
+    """Write the results of the suites whose jobs have all finished."""
+    written = collect(connect(ctx.obj["queue"]), results_dir, ctx.obj["verbose"])
+    print(f"Wrote {len(written)} result files")
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+
+"""
+Load benchmark suites from their YAML configuration files.
+
+A suite is compiled once into its expanded form: its includes are resolved,
+the defaults of the included files are moved into their categories, and the
+result is checked against the schema below. The compiled suite is cached in
+"results/.cache/suites", keyed by the modification times and hashes of all
+the files it was made from, so it is only compiled again when one of them
+changes.
+
+Suites can be narrowed down to some categories or expressions with keywords
+and tags, which is what the -k and -t options of mathics-bench use.
+
+Examples:
+- Check all the suites in the "benchmarks" directory:
+  python ./mathics_benchmark/suite.py benchmarks/*.yaml
+- Show what "-k Power" would run in "calculator-fns":
+  python ./mathics_benchmark/suite.py -v -k Power calculator-fns
+
+If you installed mathics-benchmark, this file can be called as a binary, e.g.:
+- mathics-bench-suite calculator-fns
+"""
+
+from fnmatch import fnmatchcase
+from typing import Optional
+
+import click
+import hashlib
+import json
+import os
+import os.path as osp
+import sys
+import yaml
+
+from mathics_benchmark.generators import GENERATORS
+
+
+my_dir = osp.dirname(__file__)
+
+default_cache_dir = osp.join(my_dir, "..", "results", ".cache", "suites")
+
+# Change this when the compiled form changes, to ignore older caches.
+COMPILED_VERSION = 2
+
+YAMLLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class SuiteError(Exception):
+    """A suite which can't be found, can't be read, or doesn't follow the
+    schema.
+    """
+
+
+# The keys allowed at the top level of a YAML file and in its categories,
+# with their types. See benchmarks/example.yaml for what they mean.
+TOP_LEVEL_SCHEMA = {
+    "iterations": int,
+    "compare-groups": bool,
+    "cython": bool,
+    "clean": bool,
+    "logarithmic": bool,
+    "python-mode": bool,
+    "includes": list,
+    "setup-exprs": list,
+    "categories": dict,
+}
+
+CATEGORY_SCHEMA = {
+    "iterations": int,
+    "comment": str,
+    "tags": list,
+    "python-mode": bool,
+    "merge-exprs": bool,
+    "setup-exprs": list,
+    "exprs": list,
+    "callables": list,
+    "parse": bool,
+    "inputs": list,
+    "forms": list,
+    "sizes": list,
+}
+
+# The forms a "forms" category can convert its results into. Any other
+# symbol would still run, timing a ToString or MakeBoxes that does nothing.
+FORMS = (
+    "FullForm",
+    "InputForm",
+    "MathMLForm",
+    "OutputForm",
+    "StandardForm",
+    "TeXForm",
+    "TraditionalForm",
+)
+
+# Keys of the top level which become the default of every category of an
+# included file.
+CATEGORY_DEFAULTS = ("iterations", "python-mode")
+
+
+def find_suite(config: str) -> str:
+    """The path of the YAML file for `config`, a path or a short name under
+    the "benchmarks" directory.
+    """
+    for path in [
+        config,
+        osp.join(my_dir, "benchmarks", config),
+        osp.join(my_dir, "../", "benchmarks", config),
+        osp.join(my_dir, "benchmarks", config + ".yaml"),
+        osp.join(my_dir, "../", "benchmarks", config + ".yaml"),
+    ]:
+        if osp.isfile(path):
+            return osp.realpath(path)
+    raise SuiteError(f"Cannot find the benchmark {config}")
+
+
+def find_include(path: str, include_file: str) -> str:
+    """The path of `include_file`, included from the file in `path`. It is
+    looked for next to that file first.
+    """
+    for candidate in [include_file, include_file + ".yaml"]:
+        candidate = osp.join(osp.dirname(path), candidate)
+        if osp.isfile(candidate):
+            return osp.realpath(candidate)
+    try:
+        return find_suite(include_file)
+    except SuiteError:
+        raise SuiteError(f"{path} includes {include_file}, which cannot be found")
+
+
+def check_type(where: str, value, expected: type) -> None:
+    # In Python, bool is a subclass of int; "iterations: true" is a mistake.
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        raise SuiteError(
+            f"{where} should be a {expected.__name__}, not {type(value).__name__}"
+        )
+
+
+def check_strings(where: str, values: list) -> None:
+    for value in values:
+        if not isinstance(value, str):
+            raise SuiteError(f"{where} should only have strings; quote {value!r}")
+
+
+def validate_category(path: str, name: str, category, python_mode: bool) -> None:
+    where = f"{path}: category {name!r}"
+    check_type(where, category, dict)
+    for key, value in category.items():
+        if key not in CATEGORY_SCHEMA:
+            raise SuiteError(f"{where} has an unknown key {key!r}")
+        check_type(f"{where}, {key!r}", value, CATEGORY_SCHEMA[key])
+
+    for key in ("tags", "setup-exprs", "exprs", "callables", "forms"):
+        check_strings(f"{where}, {key!r}", category.get(key, []))
+
+    if not any(key in category for key in ("exprs", "callables", "inputs")):
+        raise SuiteError(f"{where} has no 'exprs', 'callables' or 'inputs'")
+    if "callables" in category and not category.get("python-mode", python_mode):
+        raise SuiteError(f"{where} has 'callables' but is not in python-mode")
+    if "inputs" in category and not category.get("parse"):
+        raise SuiteError(f"{where} has 'inputs' but not 'parse: true'")
+    if "sizes" in category and "forms" not in category:
+        raise SuiteError(f"{where} has 'sizes' but no 'forms'")
+    if "forms" in category and "exprs" not in category:
+        raise SuiteError(f"{where} has 'forms' but no 'exprs'")
+    for form in category.get("forms", []):
+        if form not in FORMS:
+            raise SuiteError(
+                f"{where} has an unknown form {form!r}; "
+                f"the forms are {', '.join(FORMS)}"
+            )
+
+    for spec in category.get("inputs", []):
+        check_type(f"{where}, input", spec, dict)
+        if spec.get("generator") not in GENERATORS:
+            raise SuiteError(
+                f"{where} has an unknown generator {spec.get('generator')!r}"
+            )
+        check_type(f"{where}, input 'sizes'", spec.get("sizes"), list)
+
+
+def validate(path: str, bench_data) -> None:
+    """Check that `bench_data`, read from `path`, follows the schema."""
+    check_type(path, bench_data, dict)
+    for key, value in bench_data.items():
+        if key not in TOP_LEVEL_SCHEMA:
+            raise SuiteError(f"{path} has an unknown key {key!r}")
+        check_type(f"{path}, {key!r}", value, TOP_LEVEL_SCHEMA[key])
+    check_strings(f"{path}, 'includes'", bench_data.get("includes", []))
+    check_strings(f"{path}, 'setup-exprs'", bench_data.get("setup-exprs", []))
+
+    if "categories" not in bench_data and "includes" not in bench_data:
+        raise SuiteError(f"{path} has no 'categories' and no 'includes'")
+
+    for name, category in bench_data.get("categories", {}).items():
+        validate_category(path, name, category, bench_data.get("python-mode", False))
+
+
+def compile_suite(path: str, sources: dict, stack: tuple = ()) -> dict:
+    """Read the YAML file in `path` and expand its includes.
+
+    `sources` is filled with the paths of the files read. `stack` holds the
+    files which are including this one, to detect include cycles.
+    """
+    if path in stack:
+        cycle = " -> ".join(osp.basename(p) for p in stack + (path,))
+        raise SuiteError(f"Include cycle: {cycle}")
+
+    try:
+        with open(path, "rb") as file:
+            content = file.read()
+        bench_data = yaml.load(content, Loader=YAMLLoader)
+    except (OSError, yaml.YAMLError) as e:
+        raise SuiteError(f"Cannot read {path}: {e}")
+    sources[path] = file_key(path, content)
+
+    validate(path, bench_data)
+
+    categories: dict = {}
+    for include_file in bench_data.get("includes", []):
+        include_path = find_include(path, include_file)
+        include_bench_data = compile_suite(include_path, sources, stack + (path,))
+
+        # The defaults of the included file go into its categories, so that
+        # the defaults of this file don't override them.
+        for name, category in include_bench_data["categories"].items():
+            category = dict(category)
+            for key in CATEGORY_DEFAULTS:
+                if key in include_bench_data and key not in category:
+                    category[key] = include_bench_data[key]
+            if "setup-exprs" in include_bench_data:
+                category["setup-exprs"] = include_bench_data[
+                    "setup-exprs"
+                ] + category.get("setup-exprs", [])
+            categories[name] = category
+
+    categories.update(bench_data.get("categories", {}))
+    bench_data["categories"] = categories
+    return bench_data
+
+
+def file_key(path: str, content: Optional[bytes] = None) -> dict:
+    stat = os.stat(path)
+    if content is None:
+        with open(path, "rb") as file:
+            content = file.read()
+    return {
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+
+
+def is_fresh(sources: dict) -> bool:
+    """Whether none of the files in `sources` has changed. Files whose
+    modification time changed are compared by hash.
+    """
+    for path, key in sources.items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_mtime_ns == key["mtime"] and stat.st_size == key["size"]:
+            continue
+        if file_key(path)["sha256"] != key["sha256"]:
+            return False
+    return True
+
+
+# Compiled suites already loaded by this process, by path.
+loaded: dict = {}
+
+
+def load_suite(config: str, cache_dir: Optional[str] = default_cache_dir) -> dict:
+    """Return the compiled suite for `config`, compiling it only if it is
+    not cached or one of its files changed. `cache_dir` None disables the
+    cache on disk.
+
+    The result is a copy, which can be changed freely.
+    """
+    path = find_suite(config)
+    cache_path = (
+        osp.join(cache_dir, hashlib.sha256(path.encode()).hexdigest()[:16] + ".json")
+        if cache_dir
+        else None
+    )
+
+    compiled = loaded.get(path)
+    if compiled is None and cache_path and osp.isfile(cache_path):
+        try:
+            with open(cache_path) as file:
+                compiled = json.load(file)
+        except (OSError, ValueError):
+            compiled = None
+    if compiled is not None and (
+        compiled.get("version") != COMPILED_VERSION or not is_fresh(compiled["sources"])
+    ):
+        compiled = None
+
+    if compiled is None:
+        sources: dict = {}
+        compiled = {
+            "version": COMPILED_VERSION,
+            "sources": sources,
+            "bench_data": compile_suite(path, sources),
+        }
+        if cache_path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(cache_path, "w") as file:
+                    json.dump(compiled, file)
+            except (OSError, TypeError, ValueError):
+                # The cache is only an optimization.
+                pass
+    loaded[path] = compiled
+
+    # A deep copy, so callers don't change the cached suite.
+    return json.loads(json.dumps(compiled["bench_data"]))
+
+
+def matches(pattern: str, name: str) -> bool:
+    """Whether `name` matches the keyword `pattern`: a case-insensitive
+    substring, or a glob pattern if it has "*", "?" or "[".
+    """
+    if any(char in pattern for char in "*?["):
+        return fnmatchcase(name.lower(), pattern.lower())
+    return pattern.lower() in name.lower()
+
+
+def select(bench_data: dict, keywords: tuple = (), tags: tuple = ()) -> dict:
+    """Keep only the categories of `bench_data` with one of `tags`, and in
+    them only what matches one of `keywords`.
+
+    A keyword matching the name of a category keeps the whole category.
+    Otherwise it keeps the expressions and callables of the category which
+    match it, and the category is dropped if none does. A "merge-exprs"
+    category is timed as a whole, so it is only kept when its name matches.
+    """
+    if not keywords and not tags:
+        return bench_data
+
+    categories: dict = {}
+    for name, category in bench_data["categories"].items():
+        if tags and not set(tags) & set(category.get("tags", [])):
+            continue
+        if not keywords or any(matches(keyword, name) for keyword in keywords):
+            categories[name] = category
+            continue
+        if category.get("merge-exprs"):
+            continue
+
+        category = dict(category)
+        for key in ("exprs", "callables"):
+            if key in category:
+                category[key] = [
+                    item
+                    for item in category[key]
+                    if any(matches(keyword, item) for keyword in keywords)
+                ]
+        if category.get("exprs") or category.get("callables"):
+            # "inputs" are only kept along with their category.
+            category.pop("inputs", None)
+            categories[name] = category
+
+    bench_data = dict(bench_data)
+    bench_data["categories"] = categories
+    return bench_data
+
+
+@click.command()
+@click.option(
+    "-v",
+    "--verbose",
+    count=True,
+    help="Show the categories and expressions of each suite.",
+)
+@click.option(
+    "-k",
+    "--keyword",
+    "keywords",
+    multiple=True,
+    help="Only keep the categories or expressions matching this. "
+    "Can be supplied multiple times.",
+)
+@click.option(
+    "-t",
+    "--tag",
+    "tags",
+    multiple=True,
+    help="Only keep the categories with this tag. Can be supplied multiple times.",
+)
+@click.argument("configs", nargs=-1, required=True)
+def main(verbose: int, keywords: tuple, tags: tuple, configs: tuple):
+    """Check the suites in CONFIGS and show what they run."""
+    rc = 0
+    for config in configs:
+        try:
+            bench_data = select(load_suite(config), keywords, tags)
+        except SuiteError as e:
+            print(f"error: {e}")
+            rc = 1
+            continue
+
+        categories = bench_data["categories"]
+        items = {
+            name: category.get("exprs", []) + category.get("callables", [])
+            for name, category in categories.items()
+        }
+        count = sum(len(category_items) for category_items in items.values())
+        print(f"{config}: {len(categories)} categories, {count} expressions")
+        if verbose:
+            for name, category_items in items.items():
+                print(f"  {name}")
+                for item in category_items:
+                    print(f"    {item}")
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
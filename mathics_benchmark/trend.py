@@ -0,0 +1,542 @@
+#!/usr/bin/env python3
+
+"""
+Generate a trend report: how the timings of one or more benchmark suites have
+moved over a range of mathics-core commits.
+
+The report is a single HTML file which works offline. It shows a time series
+for every category, marks the commits where the timings changed, and clicking
+on a category shows the time series of its individual expressions.
+
+Results are looked up by the SHA1 recorded in them, so any result written by
+mathics-bench, mathics-bench-compare or mathics-bench-queue is used. The
+results of a suite are gathered once into "results/history/<suite>.npz",
+parsing all the result files in one go, and only new or changed result files
+are read after that.
+
+Examples:
+- Trend of the "Part" suite over the last 200 commits of master:
+  python ./mathics_benchmark/trend.py Part
+- Trend of "Part" and "MakeBoxes" over a range of commits:
+  python ./mathics_benchmark/trend.py Part MakeBoxes -r 4.0.0..master
+- Only flag changes of more than 20%:
+  python ./mathics_benchmark/trend.py Part -t 0.2
+- Queue the commits which have no results yet on mathics-bench-queue:
+  python ./mathics_benchmark/trend.py Part --submit-missing
+
+If you installed mathics-benchmark, this file can be called as a binary, e.g.:
+- mathics-bench-trend Part
+"""
+
+from typing import Optional
+
+import click
+import glob
+import html
+import json
+import numpy as np
+import os
+import os.path as osp
+import sys
+import warnings
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from mathics_benchmark import bench
+
+
+default_results_dir = osp.join(bench.my_dir, "..", "results")
+
+
+class History:
+    """The timings of every result of a suite, as a matrix with a row per
+    result file and a column per (category, expression).
+
+    Times are in seconds per iteration; NaN marks an expression missing in a
+    result.
+    """
+
+    fields = ("paths", "mtimes", "shas", "categories", "exprs", "times")
+
+    def __init__(
+        self,
+        paths: np.ndarray,
+        mtimes: np.ndarray,
+        shas: np.ndarray,
+        categories: np.ndarray,
+        exprs: np.ndarray,
+        times: np.ndarray,
+    ):
+        self.paths = paths
+        self.mtimes = mtimes
+        self.shas = shas
+        self.categories = categories
+        self.exprs = exprs
+        self.times = times
+
+    @classmethod
+    def empty(cls) -> "History":
+        return cls(
+            np.array([], dtype=str),
+            np.array([], dtype=float),
+            np.array([], dtype=str),
+            np.array([], dtype=str),
+            np.array([], dtype=str),
+            np.empty((0, 0)),
+        )
+
+    @classmethod
+    def load(cls, cache_path: str) -> "History":
+        with np.load(cache_path) as data:
+            return cls(*(data[name] for name in cls.fields))
+
+    def save(self, cache_path: str) -> None:
+        os.makedirs(osp.dirname(cache_path), exist_ok=True)
+        # np.savez adds ".npz" to names which don't have it.
+        with open(cache_path, "wb") as file:
+            np.savez(file, **{name: getattr(self, name) for name in self.fields})
+
+    def select(self, shas: list) -> np.ndarray:
+        """The rows of `times` for the commits `shas`, a row of NaN for the
+        commits without results. When a commit has several results, the most
+        recent one is used.
+        """
+        # Sorting by modification time makes later results win in the dict.
+        order = np.argsort(self.mtimes, kind="stable")
+        row_of = {sha: row for sha, row in zip(self.shas[order], order)}
+        rows = np.array([row_of.get(sha[:6], -1) for sha in shas], dtype=int)
+        selected = np.full((len(shas), len(self.exprs)), np.nan)
+        found = rows >= 0
+        selected[found] = self.times[rows[found]]
+        return selected
+
+
+def result_files(results_dir: str, suite: str) -> list:
+    """All the result files of `suite` under `results_dir`."""
+    return glob.glob(osp.join(results_dir, f"{suite}.json")) + glob.glob(
+        osp.join(results_dir, "*", f"{suite}.json")
+    )
+
+
+def load_history(suite: str, results_dir: str = default_results_dir) -> History:
+    """Load the history of `suite`, reading only the result files which are
+    not already in its cache, and update the cache.
+
+    The new files are parsed together by a single `json.loads` and their
+    timings are written into the matrix by a single assignment, so that
+    the first report over many commits does not pay for parsing and
+    filling in one file at a time.
+    """
+    cache_path = osp.join(results_dir, "history", f"{suite}.npz")
+    history = History.load(cache_path) if osp.isfile(cache_path) else History.empty()
+
+    paths = np.array(result_files(results_dir, suite), dtype=str)
+    mtimes = np.array([os.stat(path).st_mtime for path in paths], dtype=float)
+
+    # Keep the cached rows whose file still exists with the same mtime.
+    known = dict(zip(history.paths, history.mtimes))
+    fresh = np.array(
+        [known.get(path) == mtime for path, mtime in zip(paths, mtimes)], dtype=bool
+    )
+    kept = np.isin(history.paths, paths[fresh])
+    new_paths = paths[~fresh]
+    if not len(new_paths) and kept.all():
+        return history
+
+    contents = []
+    for path in new_paths:
+        with open(path) as file:
+            contents.append(file.read())
+    # A single parse of all the new files, rather than one per file.
+    loaded: list = json.loads("[" + ",".join(contents) + "]")
+
+    # Every timing of the new files as (row, category, query, time) in flat
+    # lists, so that the matrix is filled by a single assignment.
+    entries = [
+        (row, category, query, elapsed / iterations)
+        for row, result in enumerate(loaded)
+        for category, queries in result["timings"].items()
+        for query, (iterations, elapsed) in queries.items()
+    ]
+    keys = list(zip(history.categories, history.exprs))
+    cached_keys = set(keys)
+    keys += [
+        key
+        for key in dict.fromkeys((entry[1], entry[2]) for entry in entries)
+        if key not in cached_keys
+    ]
+    column_of = {key: column for column, key in enumerate(keys)}
+
+    kept_count = int(kept.sum())
+    times = np.full((kept_count + len(new_paths), len(keys)), np.nan)
+    times[:kept_count, : history.times.shape[1]] = history.times[kept]
+    if entries:
+        rows, categories, queries, values = zip(*entries)
+        columns = [column_of[key] for key in zip(categories, queries)]
+        times[kept_count + np.array(rows), columns] = values
+
+    history = History(
+        np.concatenate([history.paths[kept], new_paths]),
+        np.concatenate([history.mtimes[kept], mtimes[~fresh]]),
+        np.concatenate(
+            [
+                history.shas[kept],
+                np.array([r["info"]["Git SHA"] for r in loaded], dtype=str),
+            ]
+        ),
+        np.array([key[0] for key in keys], dtype=str),
+        np.array([key[1] for key in keys], dtype=str),
+        times,
+    )
+    history.save(cache_path)
+    return history
+
+
+def category_series(history: History, times: np.ndarray) -> dict:
+    """Reduce the columns of `times` to one series per category: the
+    geometric mean of the times of its expressions.
+    """
+    log_times = np.log(times)
+    series = {}
+    with warnings.catch_warnings():
+        # Commits without results give all-NaN slices.
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for category in dict.fromkeys(history.categories):
+            columns = history.categories == category
+            series[category] = np.exp(np.nanmean(log_times[:, columns], axis=1))
+    return series
+
+
+def change_points(series: np.ndarray, window: int = 5, threshold: float = 0.1) -> list:
+    """Find the indices in `series` where the timings change.
+
+    The geometric mean of the `window` points before each point is compared
+    with the one of the `window` points from it on. A change point is where
+    that ratio is further from 1 than `threshold`, and further than anywhere
+    else within `window` points. Returns (index, ratio) pairs; ratios over 1
+    are slowdowns.
+
+    Missing points (NaN) are skipped.
+    """
+    present = np.flatnonzero(~np.isnan(series))
+    values = np.log(series[present])
+    if len(values) < 2 * window:
+        return []
+
+    means = sliding_window_view(values, window).mean(axis=1)
+    # means[i] is the mean of values[i : i + window], so shift[i] compares
+    # the windows on each side of i + window.
+    shift = means[window:] - means[:-window]
+    magnitude = np.abs(shift)
+
+    padded = np.pad(
+        magnitude, (window // 2, window - 1 - window // 2), constant_values=-np.inf
+    )
+    local_max = magnitude >= sliding_window_view(padded, window).max(axis=1)
+    candidates = np.flatnonzero(local_max & (magnitude > np.log1p(threshold)))
+
+    changes = []
+    for index in candidates:
+        # Ties give several neighbouring maxima; keep the first one.
+        if changes and index - changes[-1] < window:
+            continue
+        changes.append(index)
+    return [
+        (int(present[index + window]), float(np.exp(shift[index]))) for index in changes
+    ]
+
+
+def to_json_list(values: np.ndarray) -> list:
+    return [None if np.isnan(value) else float(value) for value in values]
+
+
+def suite_report(
+    suite: str, shas: list, results_dir: str, window: int, threshold: float
+) -> dict:
+    """The data shown for `suite` in the dashboard."""
+    history = load_history(suite, results_dir)
+    times = history.select(shas)
+
+    categories = []
+    for category, series in category_series(history, times).items():
+        exprs = []
+        for column in np.flatnonzero(history.categories == category):
+            exprs.append(
+                {
+                    "name": str(history.exprs[column]),
+                    "series": to_json_list(times[:, column]),
+                    "changes": change_points(times[:, column], window, threshold),
+                }
+            )
+        categories.append(
+            {
+                "name": str(category),
+                "series": to_json_list(series),
+                "changes": change_points(series, window, threshold),
+                "exprs": exprs,
+            }
+        )
+    return {
+        "name": suite,
+        "covered": int((~np.isnan(times).all(axis=1)).sum()) if times.size else 0,
+        "categories": categories,
+    }
+
+
+def write_dashboard(path: str, title: str, commits: list, suites: list) -> None:
+    data = json.dumps({"commits": commits, "suites": suites})
+    # "</" would end the script element.
+    data = data.replace("</", "<\\/")
+    os.makedirs(osp.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as file:
+        file.write(
+            DASHBOARD_TEMPLATE.replace("$TITLE", html.escape(title)).replace(
+                "$DATA", data
+            )
+        )
+
+
+@click.command()
+@click.option(
+    "-r",
+    "--revisions",
+    help='The git revision range, like "4.0.0..master". The default is "master".',
+    default="master",
+)
+@click.option(
+    "-n",
+    "--max-count",
+    type=int,
+    default=200,
+    help="The maximum number of commits in the report",
+)
+@click.option(
+    "--first-parent",
+    is_flag=True,
+    help="Follow only the first parent of merge commits",
+)
+@click.option(
+    "-w",
+    "--window",
+    type=int,
+    default=5,
+    help="The number of commits compared on each side of a change point",
+)
+@click.option(
+    "-t",
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="The relative change in time needed for a change point",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(dir_okay=False, writable=True),
+    help='The HTML file to write. The default is "reports/trend/<suites>.html"',
+)
+@click.option(
+    "--results-dir",
+    type=click.Path(file_okay=False),
+    default=default_results_dir,
+    help="Where the results are",
+)
+@click.option(
+    "--submit-missing",
+    is_flag=True,
+    help="Queue the commits without results on mathics-bench-queue",
+)
+@click.argument("suites", nargs=-1, required=True)
+def main(
+    revisions: str,
+    max_count: int,
+    first_parent: bool,
+    window: int,
+    threshold: float,
+    output: Optional[str],
+    results_dir: str,
+    submit_missing: bool,
+    suites: tuple,
+):
+    """Write an HTML trend report of SUITES over a range of mathics-core
+    commits.
+    """
+    repo = bench.setup_git()
+    commits = list(
+        repo.iter_commits(revisions, max_count=max_count, first_parent=first_parent)
+    )
+    # Oldest first.
+    commits.reverse()
+    shas = [commit.hexsha for commit in commits]
+
+    reports = [
+        suite_report(suite, shas, results_dir, window, threshold) for suite in suites
+    ]
+    for report in reports:
+        print(
+            f"{report['name']}: results for {report['covered']} of {len(shas)} commits"
+        )
+
+    if submit_missing:
+        from mathics_benchmark import jobqueue
+
+        jobs = []
+        for suite in suites:
+            history = load_history(suite, results_dir)
+            missing = np.isnan(history.select(shas)).all(axis=1)
+            jobs += jobqueue.split_jobs(
+                [suite], [sha for sha, m in zip(shas, missing) if m]
+            )
+        submitted = jobqueue.submit_jobs(jobqueue.connect(), jobs, None, None)
+        print(f"Queued {submitted} jobs")
+
+    if output is None:
+        output = osp.join(
+            bench.my_dir, "..", "reports", "trend", f"{'_'.join(suites)}.html"
+        )
+    write_dashboard(
+        output,
+        f"{', '.join(suites)}: {revisions}",
+        [
+            {
+                "sha": commit.hexsha[:8],
+                "date": commit.committed_datetime.strftime("%Y-%m-%d"),
+                "summary": commit.summary,
+            }
+            for commit in commits
+        ],
+        reports,
+    )
+    print(f"Wrote {output}")
+
+
+DASHBOARD_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>$TITLE</title>
+<style>
+body { font-family: sans-serif; margin: 1em 2em; color: #222; }
+h1 { font-size: 1.3em; }
+h2 { font-size: 1.1em; margin-top: 2em; }
+.chart { display: inline-block; margin: 0.5em; vertical-align: top; }
+.chart h3 { font-size: 0.9em; font-weight: normal; margin: 0; max-width: 460px;
+  overflow: hidden; text-overflow: ellipsis; white-space: nowrap; }
+.category { cursor: pointer; }
+.category:hover { background: #f0f4ff; }
+.selected { background: #e0e8ff; }
+svg { background: white; border: 1px solid #ccc; }
+.line { fill: none; stroke: steelblue; stroke-width: 1.5; }
+.point { fill: steelblue; }
+.slower { stroke: red; stroke-dasharray: 4 2; }
+.faster { stroke: green; stroke-dasharray: 4 2; }
+.axis { font-size: 10px; fill: #666; }
+#drilldown { border-top: 1px solid #ccc; margin-top: 1em; }
+</style>
+</head>
+<body>
+<h1>$TITLE</h1>
+<p>Seconds per iteration; categories show the geometric mean of their
+expressions. Dashed lines mark changes: red is slower, green is faster.
+Click on a category to see its expressions.</p>
+<div id="suites"></div>
+<div id="drilldown"></div>
+<script>
+const DATA = $DATA;
+const WIDTH = 460, HEIGHT = 180, MARGIN = 40;
+const SVG = "http://www.w3.org/2000/svg";
+
+function element(name, attributes, parent) {
+  const node = document.createElementNS(SVG, name);
+  for (const key in attributes) node.setAttribute(key, attributes[key]);
+  if (parent) parent.appendChild(node);
+  return node;
+}
+
+function chart(title, series, changes) {
+  const div = document.createElement("div");
+  div.className = "chart";
+  const heading = document.createElement("h3");
+  heading.textContent = title;
+  heading.title = title;
+  div.appendChild(heading);
+  const svg = element("svg", {width: WIDTH, height: HEIGHT});
+  div.appendChild(svg);
+
+  const values = series.filter(v => v !== null);
+  if (!values.length) {
+    element("text", {x: MARGIN, y: HEIGHT / 2, class: "axis"}, svg).textContent = "no results";
+    return div;
+  }
+  const low = Math.min(...values), high = Math.max(...values);
+  const span = high > low ? high - low : high || 1;
+  const n = Math.max(series.length - 1, 1);
+  const x = i => MARGIN + i * (WIDTH - 2 * MARGIN) / n;
+  const y = v => HEIGHT - MARGIN / 2 - (v - low) / span * (HEIGHT - MARGIN);
+
+  for (const [index, ratio] of changes) {
+    const line = element("line", {x1: x(index), x2: x(index), y1: 0, y2: HEIGHT,
+      class: ratio > 1 ? "slower" : "faster"}, svg);
+    const commit = DATA.commits[index];
+    element("title", {}, line).textContent =
+      `${commit.sha} ${commit.summary}: ${((ratio - 1) * 100).toFixed(1)}%`;
+  }
+
+  let path = "";
+  series.forEach((v, i) => {
+    if (v === null) return;
+    path += (path && series[i - 1] !== null ? "L" : "M") + x(i) + "," + y(v);
+  });
+  element("path", {d: path, class: "line"}, svg);
+  series.forEach((v, i) => {
+    if (v === null) return;
+    const point = element("circle", {cx: x(i), cy: y(v), r: 2.5, class: "point"}, svg);
+    const commit = DATA.commits[i];
+    element("title", {}, point).textContent =
+      `${commit.sha} ${commit.date} ${commit.summary}\\n${v.toExponential(3)} s`;
+  });
+
+  element("text", {x: 2, y: 12, class: "axis"}, svg).textContent = high.toExponential(2);
+  element("text", {x: 2, y: HEIGHT - 4, class: "axis"}, svg).textContent = low.toExponential(2);
+  if (DATA.commits.length) {
+    element("text", {x: MARGIN, y: HEIGHT - 4, class: "axis"}, svg).textContent =
+      DATA.commits[0].sha;
+    element("text", {x: WIDTH - MARGIN - 50, y: HEIGHT - 4, class: "axis"}, svg).textContent =
+      DATA.commits[DATA.commits.length - 1].sha;
+  }
+  return div;
+}
+
+function drilldown(suite, category, div) {
+  document.querySelectorAll(".selected").forEach(node => node.classList.remove("selected"));
+  div.classList.add("selected");
+  const target = document.getElementById("drilldown");
+  target.innerHTML = "";
+  const heading = document.createElement("h2");
+  heading.textContent = `${suite.name} / ${category.name}`;
+  target.appendChild(heading);
+  for (const expr of category.exprs)
+    target.appendChild(chart(expr.name, expr.series, expr.changes));
+  target.scrollIntoView();
+}
+
+const container = document.getElementById("suites");
+for (const suite of DATA.suites) {
+  const heading = document.createElement("h2");
+  heading.textContent = `${suite.name} (results for ${suite.covered} of ${DATA.commits.length} commits)`;
+  container.appendChild(heading);
+  for (const category of suite.categories) {
+    const div = chart(category.name, category.series, category.changes);
+    div.classList.add("category");
+    div.addEventListener("click", () => drilldown(suite, category, div));
+    container.appendChild(div);
+  }
+}
+</script>
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
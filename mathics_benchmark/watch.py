@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+
+"""
+Watch the mathics-core repository and benchmark every new commit.
+
+The watcher polls some branches of mathics-core for new commits, runs a set
+of suites on each new commit, either itself or through mathics-bench-queue,
+and adds the results to the history used by mathics-bench-trend. Each
+benchmarked commit is compared with the one benchmarked before it on the
+same branch, and the categories which got slower than the threshold are
+reported as regression alerts: they are printed, appended to a JSON-lines
+log, and optionally POSTed to a webhook.
+
+When several commits land between two polls, the backlog policy decides
+which of them are benchmarked:
+- all: every new commit.
+- latest: only the newest one, skipping the others.
+- coalesce: at most --max-batch commits evenly spaced over the new ones,
+  always including the newest. An alert then covers the range of commits
+  since the previous benchmarked one.
+
+The first time a branch is seen only its head is benchmarked. What has been
+seen and benchmarked is kept in "results/watch-state.json", so the watcher
+can be stopped and restarted.
+
+Examples:
+- Benchmark "overall" on every new commit of master, polling every 5 minutes:
+  python ./mathics_benchmark/watch.py overall
+- Watch two branches with two suites, benchmarking at most 3 commits a poll:
+  python ./mathics_benchmark/watch.py overall Part -b master -b dev --backlog coalesce --max-batch 3
+- Send the runs to worker agents through the job queue:
+  python ./mathics_benchmark/watch.py overall -q results/jobs.sqlite
+- Watch a mirror added as a remote of the mathics-core submodule:
+  python ./mathics_benchmark/watch.py overall --remote mirror
+- Poll once and exit, e.g. from cron:
+  python ./mathics_benchmark/watch.py overall --once
+
+If you installed mathics-benchmark, this file can be called as a binary, e.g.:
+- mathics-bench-watch overall
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+import click
+import json
+import numpy as np
+import os
+import os.path as osp
+import subprocess
+import sys
+import time
+import urllib.request
+import warnings
+
+from git.exc import GitCommandError
+from gitdb.exc import BadName
+
+from mathics_benchmark import bench, jobqueue, trend
+from mathics_benchmark.suite import SuiteError
+
+
+default_results_dir = osp.join(bench.my_dir, "..", "results")
+default_state_path = osp.join(default_results_dir, "watch-state.json")
+default_alert_log = osp.join(default_results_dir, "watch-alerts.jsonl")
+
+BACKLOG_POLICIES = ("all", "latest", "coalesce")
+
+
+def apply_backlog(shas: list, policy: str, max_batch: int) -> list:
+    """The commits of `shas`, oldest first, which are benchmarked under the
+    backlog `policy`.
+    """
+    if policy == "latest" or (policy == "coalesce" and max_batch <= 1):
+        return shas[-1:]
+    if policy == "coalesce" and len(shas) > max_batch:
+        last = len(shas) - 1
+        return [shas[round(i * last / (max_batch - 1))] for i in range(max_batch)]
+    return shas
+
+
+def category_ratios(history: trend.History, previous: str, sha: str) -> dict:
+    """The time of each category at `sha` over its time at `previous`, for the
+    categories which have results at both.
+    """
+    times = history.select([previous, sha])
+    ratios = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for category, series in trend.category_series(history, times).items():
+            if not np.isnan(series).any():
+                ratios[category] = (float(series[0]), float(series[1]))
+    return ratios
+
+
+def post_webhook(url: str, payload: dict) -> None:
+    """POST `payload` as JSON to `url`. Failures are reported, not raised, so
+    that a webhook which is down does not stop the watcher.
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30):
+            pass
+    except OSError as e:
+        print(f"Webhook {url} failed: {e}")
+
+
+class Watcher:
+    """Polls the branches of a mathics-core repository, benchmarks their new
+    commits and reports regressions, keeping its state in a JSON file.
+
+    The state has, for each branch, the last commit "seen" and the last
+    commit "benchmarked", and the list of "pending" commits, oldest first,
+    whose results have not been compared yet.
+    """
+
+    def __init__(
+        self,
+        suites: list,
+        branches: list,
+        remote: Optional[str],
+        policy: str,
+        max_batch: int,
+        threshold: float,
+        iterations: Optional[int],
+        cython: Optional[bool],
+        queue_path: Optional[str],
+        state_path: str,
+        alert_log: str,
+        webhook: Optional[str],
+        verbose: int,
+    ):
+        self.suites = suites
+        self.branches = branches
+        self.remote = remote
+        self.policy = policy
+        self.max_batch = max_batch
+        self.threshold = threshold
+        self.iterations = iterations
+        self.cython = cython
+        self.connection = jobqueue.connect(queue_path) if queue_path else None
+        self.state_path = state_path
+        self.alert_log = alert_log
+        self.webhook = webhook
+        self.verbose = verbose
+        self.repo = bench.setup_git()
+        self.state = self.load_state()
+
+    def load_state(self) -> dict:
+        if osp.isfile(self.state_path):
+            with open(self.state_path) as file:
+                return json.load(file)
+        return {"branches": {}, "pending": []}
+
+    def save_state(self) -> None:
+        # Written to a temporary file first, so that a watcher killed while
+        # writing does not leave a truncated state.
+        os.makedirs(osp.dirname(self.state_path) or ".", exist_ok=True)
+        temporary_path = self.state_path + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.state, file, indent=2)
+        os.replace(temporary_path, self.state_path)
+
+    def new_commits(self, branch: str) -> list:
+        """The commits of `branch` since it was last polled, oldest first,
+        following only first parents so that a merge counts as one commit.
+        """
+        ref = f"{self.remote}/{branch}" if self.remote else branch
+        try:
+            head: str = self.repo.commit(ref).hexsha
+        except (BadName, GitCommandError, ValueError) as e:
+            print(f"{branch}: cannot find {ref}, trying again on the next poll: {e}")
+            return []
+        branch_state = self.state["branches"].setdefault(
+            branch, {"seen": None, "benchmarked": None}
+        )
+        seen: Optional[str] = branch_state["seen"]
+        branch_state["seen"] = head
+        if seen is None:
+            return [head]
+        try:
+            commits = self.repo.iter_commits(f"{seen}..{head}", first_parent=True)
+            shas = [commit.hexsha for commit in commits]
+        except GitCommandError:
+            # The last commit seen is gone, e.g. after a force push.
+            return [head]
+        shas.reverse()
+        return shas
+
+    def poll(self) -> int:
+        """Fetch the branches and queue their new commits according to the
+        backlog policy. Return the number of commits queued.
+
+        Git errors are reported and the poll is tried again at the next
+        interval, so that a network error doesn't stop the watcher.
+        """
+        if self.remote:
+            try:
+                self.repo.remotes[self.remote].fetch()
+            except (GitCommandError, IndexError) as e:
+                print(
+                    f"Fetching {self.remote} failed, trying again on the next poll: {e}"
+                )
+                return 0
+
+        queued: int = 0
+        for branch in self.branches:
+            shas = self.new_commits(branch)
+            selected = apply_backlog(shas, self.policy, self.max_batch)
+            if self.verbose and shas:
+                print(
+                    f"{branch}: {len(shas)} new commits, benchmarking {len(selected)}"
+                )
+            for sha in selected:
+                self.state["pending"].append({"branch": branch, "sha": sha})
+            if selected and self.connection is not None:
+                jobqueue.submit_jobs(
+                    self.connection,
+                    jobqueue.split_jobs(self.suites, selected),
+                    self.iterations,
+                    self.cython,
+                )
+            queued += len(selected)
+        return queued
+
+    def has_results(self, sha: str) -> bool:
+        return all(
+            osp.isfile(jobqueue.result_path(default_results_dir, sha, suite))
+            for suite in self.suites
+        )
+
+    def run_locally(self, sha: str) -> bool:
+        """Run the suites at `sha` with mathics-bench. Return whether they
+        all ran.
+
+        mathics-bench runs in a new process for each suite: this process
+        keeps the mathics-core it imported when it started, whatever
+        mathics-bench installs.
+        """
+        for suite in self.suites:
+            path = jobqueue.result_path(default_results_dir, sha, suite)
+            if osp.isfile(path):
+                continue
+            arguments = [sys.executable, "-m", "mathics_benchmark.bench", suite, sha]
+            if self.verbose:
+                arguments.append("-v")
+            if self.cython is True:
+                arguments.append("--cython")
+            elif self.cython is False:
+                arguments.append("--no-cython")
+            if self.iterations:
+                arguments += ["-i", str(self.iterations)]
+            if self.verbose:
+                print(f"running {suite} at {sha[:8]}")
+            completed_process = subprocess.run(
+                arguments, cwd=osp.join(bench.my_dir, "..")
+            )
+            # mathics-bench can fail without an error code, e.g. when
+            # installing mathics-core fails, but then it writes no results.
+            if completed_process.returncode != 0 or not osp.isfile(path):
+                return False
+        return True
+
+    def failed_in_queue(self, sha: str) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM jobs WHERE ref = ? AND state = 'failed'", (sha,)
+            ).fetchone()
+            is not None
+        )
+
+    def regressions(self, branch: str, previous: str, sha: str) -> list:
+        """The categories which are slower at `sha` than at `previous` by more
+        than the threshold.
+        """
+        commits = int(self.repo.git.rev_list("--count", f"{previous}..{sha}"))
+        alerts = []
+        for suite in self.suites:
+            history = trend.load_history(suite, default_results_dir)
+            for category, (before, after) in category_ratios(
+                history, previous, sha
+            ).items():
+                if after / before > 1 + self.threshold:
+                    alerts.append(
+                        {
+                            "time": datetime.now(timezone.utc).isoformat(),
+                            "branch": branch,
+                            "sha": sha,
+                            "previous": previous,
+                            "commits": commits,
+                            "suite": suite,
+                            "category": category,
+                            "before": before,
+                            "after": after,
+                            "ratio": after / before,
+                        }
+                    )
+        return alerts
+
+    def report(self, alerts: list) -> None:
+        for alert in alerts:
+            print(
+                f"REGRESSION {alert['branch']} {alert['sha'][:8]}: "
+                f"{alert['suite']} / {alert['category']} is x{alert['ratio']:.2f} "
+                f"slower than at {alert['previous'][:8]} "
+                f"({alert['commits']} commits)"
+            )
+        os.makedirs(osp.dirname(self.alert_log) or ".", exist_ok=True)
+        with open(self.alert_log, "a") as file:
+            for alert in alerts:
+                file.write(json.dumps(alert) + "\n")
+        if self.webhook:
+            post_webhook(self.webhook, {"alerts": alerts})
+
+    def process_pending(self) -> int:
+        """Run or collect the pending commits and compare the ones whose
+        results are ready. Return the number of commits finished.
+
+        The commits of a branch are finished in order, so that each one is
+        compared with the one benchmarked right before it.
+        """
+        if self.connection is not None:
+            jobqueue.collect(self.connection, default_results_dir, self.verbose)
+
+        finished: int = 0
+        blocked: set = set()
+        for entry in list(self.state["pending"]):
+            branch, sha = entry["branch"], entry["sha"]
+            if branch in blocked:
+                continue
+
+            if self.connection is None:
+                ready = self.run_locally(sha)
+                failed = not ready
+            else:
+                ready = self.has_results(sha)
+                failed = not ready and self.failed_in_queue(sha)
+
+            if failed:
+                print(f"{branch}: benchmarks failed at {sha[:8]}, skipping it")
+                self.state["pending"].remove(entry)
+                self.save_state()
+                continue
+            if not ready:
+                blocked.add(branch)
+                continue
+
+            branch_state = self.state["branches"][branch]
+            previous: Optional[str] = branch_state["benchmarked"]
+            if previous is not None:
+                alerts = self.regressions(branch, previous, sha)
+                if alerts:
+                    self.report(alerts)
+                elif self.verbose:
+                    print(f"{branch}: no regressions at {sha[:8]}")
+            else:
+                # Nothing to compare with; this only adds to the history.
+                for suite in self.suites:
+                    trend.load_history(suite, default_results_dir)
+            branch_state["benchmarked"] = sha
+            self.state["pending"].remove(entry)
+            # Saved after each commit, since running one can take long.
+            self.save_state()
+            finished += 1
+        return finished
+
+    def run(self, once: bool = False, interval: float = 300) -> None:
+        while True:
+            queued = self.poll()
+            self.save_state()
+            finished = self.process_pending()
+            if self.verbose:
+                print(
+                    f"{datetime.now():%Y-%m-%d %H:%M:%S}: queued {queued}, "
+                    f"finished {finished}, pending {len(self.state['pending'])}"
+                )
+            if once:
+                return
+            time.sleep(interval)
+
+
+@click.command()
+@click.option(
+    "-v",
+    "--verbose",
+    count=True,
+    help="verbosity level in tracing.\n"
+    "Can be supplied multiple times to increase verbosity.",
+)
+@click.option(
+    "-b",
+    "--branch",
+    "branches",
+    multiple=True,
+    help='A branch to watch. Can be supplied multiple times. The default is "master".',
+)
+@click.option(
+    "--remote",
+    default="origin",
+    help='The remote to fetch the branches from, "" for local branches.',
+)
+@click.option(
+    "--backlog",
+    type=click.Choice(BACKLOG_POLICIES),
+    default="coalesce",
+    help="Which of the commits that landed between two polls are benchmarked",
+)
+@click.option(
+    "--max-batch",
+    type=int,
+    default=5,
+    help="The most commits of a branch benchmarked per poll with --backlog coalesce",
+)
+@click.option(
+    "-t",
+    "--threshold",
+    type=float,
+    default=0.1,
+    help="The relative slowdown of a category that raises an alert",
+)
+@click.option(
+    "-i",
+    "--iterations",
+    type=int,
+    help="Override the number of iterations",
+)
+@click.option(
+    "--cython/--no-cython",
+    help="Run Cython on setup. The default is what the YAML file says.",
+    default=None,
+)
+@click.option(
+    "-q",
+    "--queue",
+    type=click.Path(),
+    help="Send the runs to this mathics-bench-queue job queue instead of running them",
+)
+@click.option(
+    "--interval",
+    type=float,
+    default=300,
+    help="Seconds between polls",
+)
+@click.option(
+    "--once",
+    is_flag=True,
+    help="Poll once, process what is ready and exit",
+)
+@click.option(
+    "--state",
+    type=click.Path(dir_okay=False),
+    default=default_state_path,
+    help="The file where the watcher keeps what it has seen",
+)
+@click.option(
+    "--alert-log",
+    type=click.Path(dir_okay=False),
+    default=default_alert_log,
+    help="The JSON-lines file regression alerts are appended to",
+)
+@click.option(
+    "--webhook",
+    help="A URL regression alerts are POSTed to as JSON",
+)
+@click.argument("configs", nargs=-1, required=True)
+def main(
+    verbose: int,
+    branches: tuple,
+    remote: str,
+    backlog: str,
+    max_batch: int,
+    threshold: float,
+    iterations: Optional[int],
+    cython: Optional[bool],
+    queue: Optional[str],
+    interval: float,
+    once: bool,
+    state: str,
+    alert_log: str,
+    webhook: Optional[str],
+    configs: tuple,
+):
+    """Benchmark the suites in CONFIGS on every new commit of the watched
+    mathics-core branches.
+
+    "run-all" stands for every suite in the "benchmarks" directory.
+    """
+    suites: list[str] = []
+    for suite in jobqueue.expand_suites(list(configs)):
+        try:
+            bench.get_bench_data(suite)
+        except SuiteError as e:
+            print(f"skipping {suite}: {e}")
+            continue
+        suites.append(suite)
+    if not suites:
+        print("No suite to run")
+        return 1
+
+    watcher = Watcher(
+        suites,
+        list(branches) or ["master"],
+        remote or None,
+        backlog,
+        max_batch,
+        threshold,
+        iterations,
+        cython,
+        queue,
+        state,
+        alert_log,
+        webhook,
+        verbose,
+    )
+    try:
+        watcher.run(once, interval)
+    except KeyboardInterrupt:
+        watcher.save_state()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
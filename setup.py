@@ -29,6 +29,10 @@ setup(
         "console_scripts": [
             "mathics-bench = mathics_benchmark.bench:main",
             "mathics-bench-compare = mathics_benchmark.compare:main",
+            "mathics-bench-queue = mathics_benchmark.jobqueue:main",
+            "mathics-bench-trend = mathics_benchmark.trend:main",
+            "mathics-bench-suite = mathics_benchmark.suite:main",
+            "mathics-bench-watch = mathics_benchmark.watch:main",
         ]
     },
     packages=["mathics_benchmark", ],
@@ -38,6 +42,7 @@ setup(
         "GitPython",
         "PyYAML",
         'matplotlib>="3.4.0',
+        "numpy>=1.20",
     ],
     license="GPLv3",
     url="https://github.com/Mathics3/mathics-benchmark/",